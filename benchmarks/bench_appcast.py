@@ -0,0 +1,313 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+"""
+Benchmarks of appcast parsing and update checking.
+
+Synthetic appcasts with the given numbers of items and enclosures per item are generated deterministically
+and served by a local HTTP server, so no network access is needed. For each appcast the following is measured:
+
+* ``parse``: :meth:`Appcast.parse_update_data` of the appcast read from memory;
+* ``check``: :meth:`PySparkle.check_update` with an empty update cache (download, decompression and parsing);
+* ``recheck``: :meth:`PySparkle.check_update` with the update cache filled, which is what the application
+  startup normally does (the server responds with ``304 Not Modified``).
+
+The best time of several repeats and the peak memory allocated during a single run are reported. Results are
+appended to a history file (one JSON object per line) and compared with the median of the previous runs
+on the same machine and Python version, so regressions can be spotted.
+
+Run ``python benchmarks/bench_appcast.py --help`` for the options.
+"""
+
+import sys
+import os
+import io
+import gzip
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import statistics
+import subprocess
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysparkle import PySparkle
+from pysparkle.backend.appcast import get_os_arch
+
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.jsonl')
+
+PLATFORMS = ['windows-x64', 'windows-x86', 'macos', 'linux-x86_64', 'linux-i386', 'linux-aarch64', 'freebsd-x64']
+DISTS = [None, 'ubuntu', 'ubuntu-22.04', 'debian-12', 'fedora-39', 'arch']
+
+
+def make_appcast(items, enclosures, seed=0):
+    """
+    Generate a synthetic appcast.
+
+    :param items: Number of items.
+    :param enclosures: Number of enclosures in each item.
+    :param seed: Random seed. The same seed always gives the same appcast.
+    :return: appcast XML as bytes
+    """
+    rng = random.Random(seed)
+    os_name, arch = get_os_arch()
+    # make sure some enclosures match the current platform
+    platforms = PLATFORMS + ['{}-{}'.format(os_name, arch), os_name]
+    out = io.StringIO()
+    out.write('<?xml version="1.0" encoding="utf-8"?>\n'
+              '<rss version="2.0" xmlns:sparkle="http://www.andymatuschak.org/xml-namespaces/sparkle">\n'
+              '<channel>\n<title>Benchmark</title>\n')
+    for i in range(items, 0, -1):
+        ver = '{}.{}.{}'.format(i // 10000, i // 100 % 100, i % 100)
+        out.write('<item>\n<title>Version {}</title>\n'.format(ver))
+        out.write('<description><![CDATA[<ul><li>{}</li></ul>]]></description>\n'
+                  .format(' '.join(rng.choice(('Fixed', 'Improved', 'Added', 'bug', 'speed', 'feature'))
+                                   for _ in range(rng.randint(5, 30)))))
+        out.write('<pubDate>Mon, 01 Jan 2024 00:00:00 +0000</pubDate>\n')
+        for j in range(enclosures):
+            os_attr = platforms[j % len(platforms)] if j else None
+            dist = rng.choice(DISTS) if os_attr and os_attr.startswith('linux') else None
+            out.write('<enclosure url="https://example.com/app-{ver}-{j}.bin" sparkle:version="{ver}" '
+                      'length="{length}" type="application/octet-stream" '
+                      'sparkle:edSignature="{sig}"{os}{dist}/>\n'
+                      .format(ver=ver, j=j, length=rng.randint(10**6, 10**8),
+                              sig='{:088x}'.format(rng.getrandbits(352))[:88],
+                              os=' sparkle:os="{}"'.format(os_attr) if os_attr else '',
+                              dist=' sparkle:dist="{}"'.format(dist) if dist else ''))
+        out.write('</item>\n')
+    out.write('</channel>\n</rss>\n')
+    return out.getvalue().encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        try:
+            data, etag = self.server.files[self.path]
+        except KeyError:
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        encoding = None
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data, encoding = self.server.compressed[self.path], 'gzip'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(object):
+    """
+    Local HTTP server serving appcasts from memory. It supports ETag and gzip transfer encoding.
+    """
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.files = {}
+        self.httpd.compressed = {}
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, path, data):
+        self.httpd.files[path] = data, '"{:08x}"'.format(zlib.crc32(data))
+        self.httpd.compressed[path] = gzip.compress(data, 6, mtime=0)
+        return 'http://127.0.0.1:{}{}'.format(self.httpd.server_port, path)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def make_pysparkle(url, config=None):
+    return PySparkle(url, 'Benchmark', '0.0.0', frontend='headless', config={} if config is None else config,
+                     timeout=60, show_notes=True, shutdown=False, startup_check=False)
+
+
+def measure(func, repeat):
+    """
+    Run the function several times.
+
+    :param func: Function to run. It is called with no arguments.
+    :param repeat: Number of timed runs.
+    :return: tuple of the best time in seconds and the peak allocated memory in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run(sizes, repeat, seed=0):
+    """
+    Run all the benchmarks.
+
+    :param sizes: List of tuples with the number of items and the number of enclosures in each item.
+    :param repeat: Number of timed runs for each benchmark.
+    :param seed: Random seed for the appcast generation.
+    :return: dict with the results; keys are benchmark names and values are tuples of time and memory peak
+    """
+    results = {}
+    server = Server()
+    try:
+        for items, enclosures in sizes:
+            data = make_appcast(items, enclosures, seed)
+            name = '{}x{}'.format(items, enclosures)
+            url = server.add('/' + name + '.xml', data)
+            pysparkle = make_pysparkle(url)
+
+            def parse():
+                pysparkle.backend.parse_update_data(io.BytesIO(data), True)
+
+            def check():
+                pysparkle.config.pop('update_cache', None)
+                pysparkle.check_update(verbose=False, force=True)
+
+            def recheck():
+                pysparkle.check_update(verbose=False, force=True)
+
+            for bench, func in (('parse', parse), ('check', check), ('recheck', recheck)):
+                if bench == 'recheck':
+                    check()
+                key = '{}/{}'.format(bench, name)
+                results[key] = measure(func, repeat)
+                report(key, *results[key])
+    finally:
+        server.close()
+    return results
+
+
+def report(name, seconds, peak, previous=None):
+    line = '{:<24} {:>10.2f} ms {:>10.1f} KiB'.format(name, 1000. * seconds, peak / 1024.)
+    if previous is not None:
+        line += '   {:+7.1f}% time {:+7.1f}% memory'.format(100. * (seconds / previous[0] - 1.),
+                                                          100. * (peak / previous[1] - 1.) if previous[1] else 0.)
+    print(line)
+    sys.stdout.flush()
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment():
+    return {'machine': platform.node(), 'python': platform.python_version()}
+
+
+def load_history(filename):
+    """
+    Load the previous results from the history file.
+
+    :param filename: History file name.
+    :return: list of records
+    """
+    history = []
+    try:
+        with open(filename) as history_file:
+            for line in history_file:
+                line = line.strip()
+                if line:
+                    history.append(json.loads(line))
+    except IOError:
+        pass
+    return history
+
+
+def compare(results, history, threshold, last=5):
+    """
+    Compare the results with the median of the last runs in the same environment.
+
+    :param results: Current results.
+    :param history: List of the previous records.
+    :param threshold: Allowed relative slowdown.
+    :param last: Number of the previous runs taken into account.
+    :return: list of names of the regressed benchmarks
+    """
+    environment = _environment()
+    history = [record for record in history if record.get('environment') == environment][-last:]
+    regressions = []
+    if not history:
+        return regressions
+    print("\nComparison with the median of {} previous run(s):".format(len(history)))
+    for name, (seconds, peak) in sorted(results.items()):
+        previous = [record['results'][name] for record in history if name in record['results']]
+        if not previous:
+            continue
+        previous = statistics.median(p[0] for p in previous), statistics.median(p[1] for p in previous)
+        report(name, seconds, peak, previous)
+        # timings below a millisecond are too noisy to be compared relatively
+        if seconds > previous[0] * (1. + threshold) + 0.001 or peak > previous[1] * (1. + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark appcast parsing and update checking.")
+    parser.add_argument('--items', default='10,1000,100000',
+                        help="comma-separated numbers of appcast items (default: %(default)s)")
+    parser.add_argument('--enclosures', default='1,10',
+                        help="comma-separated numbers of enclosures in each item (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3, help="number of timed runs (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="appcast generator seed (default: %(default)s)")
+    parser.add_argument('--history', default=HISTORY, help="results history file (default: %(default)s)")
+    parser.add_argument('--no-save', action='store_true', help="do not append the results to the history file")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative slowdown or memory increase reported as a regression (default: %(default)s)")
+    parser.add_argument('--check', action='store_true', help="exit with status 1 if a regression is found")
+    args = parser.parse_args(argv)
+
+    sizes = [(int(items), int(enclosures))
+             for items in args.items.split(',') for enclosures in args.enclosures.split(',')]
+    print('{:<24} {:>13} {:>14}'.format('benchmark', 'best time', 'memory peak'))
+    results = run(sizes, args.repeat, args.seed)
+
+    history = load_history(args.history)
+    regressions = compare(results, history, args.threshold)
+    if not args.no_save:
+        with open(args.history, 'a') as history_file:
+            json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': _git_revision(),
+                       'environment': _environment(), 'seed': args.seed, 'results': results}, history_file,
+                      sort_keys=True)
+            history_file.write('\n')
+    if regressions:
+        print("\nRegressions: " + ", ".join(regressions))
+        if args.check:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
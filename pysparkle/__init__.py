@@ -7,14 +7,17 @@ import shlex
 import importlib
 import webbrowser
 import tempfile
+import time
+import random
+import threading
 
-try:
-    from urllib2 import urlretrieve
-except ImportError:
-    from urllib.request import urlretrieve
-
-from .backend import ConnectionError
+from .backend import PySparkleError, ConnectionError, DownloadCancelled, VerificationError
+from .backend.verify import Verifier
+from .backend.cache import DownloadCache
+from .backend.delta import apply_patch
 from .backend.appcast import Appcast
+from .version import version_key
+from .scheduler import Scheduler
 
 try:
     unicode = unicode
@@ -35,10 +38,15 @@ class PySparkle(object):
     Normally you would do so at application startup and store it, so the user can check for
     update manually.
 
-    :param url: Appcast URL for your application.
+    :param url: Appcast URL for your application. It can also be a list of URLs of several feeds
+                (e.g. stable, beta, and nightly), which are fetched concurrently and merged. Items
+                from ``sparkle:channel`` channels are offered only if the channel is listed in 'channels'
+                in the config. A tuple of URLs (alone or in the list) means mirrors of the same feed; the first
+                one to respond is used. Enclosure mirrors can be listed in ``sparkle:mirrors`` attribute.
     :param appname: Application name to display in a window.
     :param appver: Current application version.
-    :param frontend: String containing frontend name. Currently only 'qt' is implemented.
+    :param frontend: String containing frontend name: 'qt' or 'headless' (for unattended updates, see
+                     :mod:`pysparkle.frontend.headless`).
     :param config: Dict-like object storing both the PySparkle configuration as well as its internal state.
                    It should be a persistent dict, e.g. provided by a shelve module, or QSettings proxy.
                    After PySparkle writes anything to this dict it tries to call its 'sync' method, in which
@@ -49,15 +57,46 @@ class PySparkle(object):
                      returning such Boolean value. The callable must not close the application itself, but it
                      should return `True` if the application can be shut down. PySparkle will issue ``os.execv(...)``
                      to close the application and launch the installer.
+    :param background: If this flag is set to True, the automatic check at startup is done in a background thread
+                       after a random delay (see 'check_startup_jitter' in :class:`~pysparkle.scheduler.Scheduler`),
+                       so the application startup does not wait for the network.
+    :param startup_check: If this flag is set to False, no automatic check is done at startup and no periodic
+                          checks are scheduled, so the checks can be driven only by the calling code.
+
+    Downloaded installers are kept in a cache, so they are not downloaded again if the update is retried.
+    Its directory and maximum size in bytes can be set with 'download_cache_dir' and 'download_cache_size'
+    in the config. Large installers can be downloaded over several connections at once by setting
+    'download_segments' in the config to the number of connections.
+
+    If 'check_interval' is set in the config, update checks are repeated periodically
+    (see :class:`~pysparkle.scheduler.Scheduler`).
+
+    Updates with ``sparkle:phasedRolloutInterval`` are rolled out in phases like in Sparkle: each installation
+    gets a random rollout group (stored in the config as 'rollout_group', which can also be set manually,
+    e.g. to 0 for canary machines), and group `n` is offered the update `n` intervals after its ``pubDate``.
+    Manual checks (with `verbose` flag) offer the update immediately.
+
+    If 'predownload' in the config is True, the installer of an update found by an automatic check is downloaded
+    and verified in the background before the user is asked about it, so it can be installed immediately.
+    The download rate can be limited with 'predownload_rate' in bytes per second and the download can be
+    paused with :meth:`pause_predownload`.
+
+    Versions are compared like in Sparkle, so 1.10 is newer than 1.9. If 'version_scheme' in the config is set to
+    'pep440', PEP 440 versioning is used instead (this requires `packaging` module).
     """
-    def __init__(self, url, appname, appver, frontend='qt', config=_DebugDict(), timeout=3, show_notes=False, shutdown=True):
+    def __init__(self, url, appname, appver, frontend='qt', config=_DebugDict(), timeout=3, show_notes=False, shutdown=True,
+                 background=False, startup_check=True):
         self.appname = appname
         self.skipver = config.get('skip_version')
         self.appver = appver
         self.config = config
+        self.version_scheme = config.get('version_scheme', 'sparkle')
+        self.appkey = version_key(appver, self.version_scheme)
+        self.skipkey = None
         if self.skipver is not None:
-            if self.skipver < self.appver:
-                config['skip_version'] = self.skipver = None
+            self.skipkey = version_key(self.skipver, self.version_scheme)
+            if self.skipkey < self.appkey:
+                config['skip_version'] = self.skipver = self.skipkey = None
                 try:
                     config.sync()
                 except AttributeError:
@@ -67,11 +106,23 @@ class PySparkle(object):
         self.shutdown = shutdown
         self.frontend = importlib.import_module('.frontend.' + frontend, __name__)
         self.backend = Appcast(url, self)
+        self.cache = DownloadCache(config.get('download_cache_dir'), config.get('download_cache_size', 2**30))
+        self.scheduler = Scheduler(self)
+        self._check_lock = threading.Lock()
+        self._check_pending = None
+        self._predownload = None
+        if not startup_check:
+            return
         auto_check = self.config.get('automatic_check')
         if auto_check is None:
             auto_check = self.ask_for_autocheck()
         if auto_check:
-            self.check_update(verbose=False)
+            self.scheduler.start()
+            if self.scheduler.due():
+                if background:
+                    self.scheduler.start_due()
+                else:
+                    self.check_update(verbose=False)
 
     def ask_for_autocheck(self):
         """
@@ -86,7 +137,7 @@ class PySparkle(object):
             pass
         return answer
 
-    def check_update(self, verbose=True, force=False):
+    def check_update(self, verbose=True, force=False, background=False):
         """
         Check for update. If new version is found, a dialog is displayed with its summary. User can then
         either download (and install) the new version, skip the current version or close the dialog allowing
@@ -95,11 +146,272 @@ class PySparkle(object):
         :param verbose: If this flag is set to True, the info is displayed on errors and in case there is no update.
                         Otherwise errors and no-updates are silently ignored.
         :param force: If this flag is set to True, last skipped version is ignored as if it were never set.
+        :param background: If this flag is set to True, update information is downloaded and parsed in a background
+                           thread and this method returns immediately. Any dialogs are then displayed in the main
+                           thread using the frontend ``call_in_main_thread`` function.
+
+        If another check is already in progress, no new request is made. Instead the flags are merged into the
+        running check, which then shows its result as if it were called with them.
         :return:
         """
+        if not self._begin_check(verbose, force):
+            return
+        if background:
+            thread = threading.Thread(target=self._check_update_background)
+            thread.daemon = True
+            try:
+                thread.start()
+            except BaseException:
+                self._end_check()
+                raise
+        else:
+            try:
+                items, err = self._fetch_update()
+            finally:
+                verbose, force = self._end_check()
+            self._process_update(items, err, verbose, force)
+
+    def _begin_check(self, verbose, force):
+        """
+        Register a new check.
+        :return: True if the check should be started or False if it was merged into the one in progress
+        """
+        with self._check_lock:
+            if self._check_pending is not None:
+                pending_verbose, pending_force = self._check_pending
+                self._check_pending = pending_verbose or verbose, pending_force or force
+                return False
+            self._check_pending = verbose, force
+            return True
+
+    def _end_check(self):
+        """
+        Finish the check in progress.
+        :return: tuple of merged verbose and force flags of the check
+        """
+        with self._check_lock:
+            pending, self._check_pending = self._check_pending, None
+        return pending
+
+    def _fetch_update(self):
+        """
+        Download and parse update information and schedule the next check.
+        :return: tuple of parsed items and an exception raised while retrieving them
+        """
         try:
-            items = self.backend.check_update(self.show_notes)
-        except Exception as err:
+            items, err = self.backend.check_update(self.show_notes), None
+        except Exception as exc:
+            items, err = None, exc
+        self.scheduler.checked(err)
+        return items, err
+
+    def _check_update_background(self):
+        try:
+            items, err = self._fetch_update()
+        finally:
+            verbose, force = self._end_check()
+        call_in_main_thread = getattr(self.frontend, 'call_in_main_thread', None)
+        if call_in_main_thread is None:
+            self._process_update(items, err, verbose, force)
+        else:
+            call_in_main_thread(self._process_update, items, err, verbose, force)
+
+    async def check_update_async(self, verbose=True, force=False):
+        """
+        Asynchronous version of :meth:`check_update` to be awaited in an asyncio event loop
+        (for Qt applications use e.g. `qasync`).
+
+        Update information and the installer are downloaded in the loop default executor, so the loop is never
+        blocked by the network. Dialogs and download progress are shown in the loop thread.
+
+        :param verbose: If this flag is set to True, the info is displayed on errors and in case there is no update.
+                        Otherwise errors and no-updates are silently ignored.
+        :param force: If this flag is set to True, last skipped version is ignored as if it were never set.
+        """
+        # asyncio is imported only here, as it noticeably slows down the import of this module
+        import asyncio
+        if not self._begin_check(verbose, force):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            items, err = await loop.run_in_executor(None, self._fetch_update)
+        finally:
+            verbose, force = self._end_check()
+        item = self._select_update(items, err, verbose, force)
+        if item is not None:
+            install = self._install_command(item)
+            filename = err = None
+            if install is not None:
+                try:
+                    filename = await self.download_async(item)
+                except Exception as exc:
+                    err = exc
+            self._install_downloaded(item, install, filename, err)
+
+    def download(self, item, progress=None, segments=None):
+        """
+        Download the installer of the given item to the download cache, showing the download progress if
+        the frontend supports it. If the installer is already cached, it is not downloaded again.
+        Interrupted downloads are resumed on the next attempt. The file is verified against the item length,
+        digest, and signatures while it is downloaded (see :class:`~pysparkle.backend.verify.Verifier`).
+
+        If the item has a delta update from the current version and the installer of the current version is
+        in the cache, only the delta is downloaded and applied to it. If anything goes wrong with the delta,
+        the full installer is downloaded.
+
+        :param item: Update item to download.
+        :param progress: Progress object with ``update`` and ``close`` methods. If None, it is obtained from
+                         the frontend ``download_progress`` function.
+        :param segments: Number of concurrent connections. By default 'download_segments' from the config is used.
+        :return: downloaded file name
+        """
+        filename = self.cache.get(item, Verifier(item, self.config))
+        if filename is not None:
+            return filename
+        filename = self.cache.filename(item)
+        verifier = Verifier(item, self.config)
+        own_progress = progress is None
+        if own_progress:
+            progress = getattr(self.frontend, 'download_progress', None)
+            if progress is not None:
+                progress = progress(self, item)
+        try:
+            if not self._download_delta(item, filename, progress, segments):
+                self.backend.download(item.get('mirrors') or item['url'], filename,
+                                      progress.update if progress is not None else None,
+                                      verifier=verifier, length=item.get('length'), segments=segments)
+        finally:
+            if own_progress and progress is not None:
+                progress.close()
+        self.cache.add(item)
+        self.cache.evict(keep=item)
+        return filename
+
+    def _download_delta(self, item, filename, progress, segments=None):
+        """
+        Try to create the installer by applying the delta update to the cached installer of the current version.
+        :return: True if the installer has been created and verified
+        """
+        delta = item.get('delta')
+        # the item may come from the update cache made by a previous application version
+        if delta is None or delta.get('delta_from') is None or \
+                version_key(delta['delta_from'], self.version_scheme) != self.appkey:
+            return False
+        old = self.cache.find(delta['delta_from'])
+        if old is None:
+            return False
+        patch = filename + '.delta'
+        patched = filename + '.patched'
+        try:
+            self.backend.download(delta.get('mirrors') or delta['url'], patch,
+                                  progress.update if progress is not None else None,
+                                  verifier=Verifier(delta, self.config), length=delta.get('length'),
+                                  segments=segments)
+            apply_patch(old, patch, patched, Verifier(item, self.config))
+        except DownloadCancelled:
+            raise
+        except Exception:
+            try:
+                os.remove(patched)
+            except OSError:
+                pass
+            return False
+        finally:
+            try:
+                os.remove(patch)
+            except OSError:
+                pass
+        os.replace(patched, filename)
+        return True
+
+    async def download_async(self, item):
+        """
+        Asynchronous version of :meth:`download`. The file is downloaded in the loop default executor
+        and the download progress is shown in the loop thread.
+
+        :param item: Update item to download.
+        :return: downloaded file name
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        progress = getattr(self.frontend, 'download_progress', None)
+        if progress is not None:
+            progress = _ThreadsafeProgress(loop, progress(self, item))
+        try:
+            return await loop.run_in_executor(None, self.download, item, progress)
+        finally:
+            if progress is not None:
+                progress.progress.close()
+
+    def _process_update(self, items, err, verbose, force):
+        item = self._select_update(items, err, verbose, force)
+        if item is not None:
+            self.install(item)
+
+    def find_update(self, force=False, phased=True):
+        """
+        Download update information and find the newest update without asking the user.
+
+        :param force: If this flag is set to True, last skipped version is ignored as if it were never set.
+        :param phased: If this flag is set to False, updates in phased rollout are found even if the rollout
+                       has not reached this installation yet.
+        :return: the newest update item or None if there is no update
+        :raise ConnectionError: if the update information cannot be retrieved
+        :raise PySparkleError: if the update information is invalid
+        """
+        items, err = self._fetch_update()
+        if isinstance(err, PySparkleError):
+            raise err
+        elif err is not None:
+            raise PySparkleError("Invalid update information: {}".format(err)) from err
+        if items and phased:
+            items = self._released(items)
+        if not items:
+            return None
+        appkey = self.appkey if (force or self.skipkey is None) else self.skipkey
+        maxitem = max(items, key=lambda item: item['key'])
+        if maxitem['key'] > appkey:
+            return maxitem
+
+    def install(self, item, command=None):
+        """
+        Download the installer of the given item and run it. If there is no installer command or the download
+        fails, the update link is opened in the web browser instead.
+
+        :param item: Update item to install.
+        :param command: Installer command used instead of the one from the appcast. ``{file}`` in it is replaced
+                        with the downloaded file name.
+        """
+        install = command if command is not None else self._install_command(item)
+        filename = err = None
+        if install is not None:
+            try:
+                filename = self.download(item)
+            except Exception as exc:
+                err = exc
+        self._install_downloaded(item, install, filename, err)
+
+    def _install_downloaded(self, item, install, filename, err=None):
+        """
+        Run the installer after its download, shared by :meth:`install` and :meth:`check_update_async`.
+
+        :param filename: Downloaded file name or None if there is no installer or the download failed.
+        :param err: Exception raised by the download. If the download was cancelled or the file cannot be
+                    verified, nothing is installed; on other errors the update link is opened in the web browser.
+        """
+        if isinstance(err, DownloadCancelled):
+            return
+        if isinstance(err, VerificationError):
+            self.frontend.update_error(unicode(err))
+            return
+        self._install_update(item, install, filename)
+
+    def _select_update(self, items, err, verbose, force):
+        """
+        Find the newest item and ask the user what to do with it.
+        :return: item to get or None if there is no update or the user did not want it
+        """
+        if err is not None:
             if verbose: self.frontend.update_error(unicode(err))
         else:
             if items is None:
@@ -108,64 +420,230 @@ class PySparkle(object):
             elif not items:
                 if verbose: self.frontend.no_info(self)
                 return
+            if not verbose:
+                items = self._released(items)
+                if not items:
+                    return
             # Filter by current os, architecture, and distribution
-            appver = self.appver if (force or self.skipver is None) else self.skipver
-            maxitem = max((item for item in items), key=lambda item: item['ver'])
-            if appver >= maxitem['ver']:
+            appkey = self.appkey if (force or self.skipkey is None) else self.skipkey
+            maxitem = max(items, key=lambda item: item['key'])
+            if appkey >= maxitem['key']:
                 if verbose: self.frontend.no_update(self)
                 return
-            notes = [item for item in items if item['ver'] >= self.appver] if self.show_notes else []
-            answer = self.frontend.update_available(self, maxitem, notes)
-            if answer is not None:
-                if answer:
-                    url = maxitem['url']
-                    if url is None: url = maxitem['link']
-                    install = maxitem.get('install')
-                    if self.shutdown is False:
-                        install = None
-                    if install is not None:
-                        filename = os.path.join(tempfile.gettempdir(), os.path.basename(url))
+            notes = [item for item in items if item['key'] > self.appkey] if self.show_notes else []
+            if not verbose and self.config.get('predownload') and self._install_command(maxitem) is not None \
+                    and self.cache.get(maxitem) is None:
+                self._start_predownload(maxitem, notes)
+                return
+            return self._ask_update(maxitem, notes)
+
+    def _ask_update(self, maxitem, notes):
+        """
+        Ask the user what to do with the update.
+        :return: item to get or None if the user did not want it
+        """
+        answer = self.frontend.update_available(self, maxitem, notes)
+        if answer is not None:
+            if answer:
+                return maxitem
+            else:
+                self.config['skip_version'] = self.skipver = maxitem['ver']
+                self.skipkey = maxitem['key']
+                try:
+                    self.config.sync()
+                except AttributeError:
+                    pass
+
+    def _start_predownload(self, item, notes):
+        """
+        Download the installer in a background thread and ask the user about the update once it is ready.
+        """
+        with self._check_lock:
+            if self._predownload is not None:
+                return
+            self._predownload = _BackgroundProgress(self.config.get('predownload_rate'))
+        thread = threading.Thread(target=self._run_predownload, args=(item, notes, self._predownload))
+        thread.daemon = True
+        thread.start()
+
+    def _run_predownload(self, item, notes, progress):
+        try:
+            self.download(item, progress, segments=1)
+        except DownloadCancelled:
+            return
+        except Exception:
+            # the user is asked anyway and the download is retried if the update is accepted
+            pass
+        finally:
+            with self._check_lock:
+                self._predownload = None
+        call_in_main_thread = getattr(self.frontend, 'call_in_main_thread', None)
+        if call_in_main_thread is None:
+            self._offer_update(item, notes)
+        else:
+            call_in_main_thread(self._offer_update, item, notes)
+
+    def _offer_update(self, item, notes):
+        if self._ask_update(item, notes) is not None:
+            self.install(item)
+
+    def pause_predownload(self):
+        """
+        Pause the background download of the update (see 'predownload' config key).
+        """
+        predownload = self._predownload
+        if predownload is not None:
+            predownload.resumed.clear()
+
+    def resume_predownload(self):
+        """
+        Resume the paused background download of the update.
+        """
+        predownload = self._predownload
+        if predownload is not None:
+            predownload.resumed.set()
+
+    def cancel_predownload(self):
+        """
+        Cancel the background download of the update. The partially downloaded file is kept, so the download
+        is resumed by the next check and the user is not asked about the update until then.
+        """
+        predownload = self._predownload
+        if predownload is not None:
+            predownload.cancelled = True
+            predownload.resumed.set()
+
+    #: Number of phased rollout groups
+    ROLLOUT_GROUPS = 7
+
+    @property
+    def rollout_group(self):
+        """
+        Phased rollout group of this installation. It is drawn randomly on first use and stored in the config.
+        """
+        group = self.config.get('rollout_group')
+        if group is None:
+            self.config['rollout_group'] = group = random.SystemRandom().randrange(self.ROLLOUT_GROUPS)
+            try:
+                self.config.sync()
+            except AttributeError:
+                pass
+        return group
+
+    def _released(self, items):
+        """
+        Filter out items, whose phased rollout has not reached this installation yet.
+        """
+        now = time.time()
+        released = []
+        for item in items:
+            interval = item.get('rollout_interval')
+            if interval and now < item['pub_date'] + self.rollout_group * interval:
+                continue
+            released.append(item)
+        return released
+
+    def _install_command(self, item):
+        if self.shutdown is False:
+            return None
+        return item.get('install')
+
+    def _install_update(self, item, install, filename):
+        """
+        Run the downloaded installer or, if this is not possible, open the update link in the web browser.
+        """
+        url = item['url']
+        if url is None: url = item['link']
+        if filename is not None:
+            try:
+                install = install.format(file=filename)
+                install_args = [s for s in shlex.split(install)]
+                if self.shutdown is True or self.shutdown():
+                    if os.name == 'nt':
                         try:
-                            filename, headers = urlretrieve(url, filename)
-                            install = install.format(file=filename)
-                            install_args = [s for s in shlex.split(install)]
-                            if self.shutdown is True or self.shutdown():
-                                if os.name == 'nt':
-                                    try:
-                                        os.execvp(install_args[0], install_args)
-                                    except OSError:
-                                        # This error may happen because the installer is run with elevated privileges
-                                        try:
-                                            import win32com.client
-                                        except (ModuleNotFoundError, ImportError):
-                                            batch_handle, batch_filename = tempfile.mkstemp(suffix='.cmd')
-                                            with os.fdopen(batch_handle, "w") as batch_file:
-                                                print('@echo off\nstart %*\n(goto) 2>nul & del "%~f0"', file=batch_file)
-                                            os.execv(batch_filename, [batch_filename] + install_args)
-                                        else:
-                                            shell = win32com.client.Dispatch("WScript.Shell")
-                                            try:
-                                                shell.Run(install)
-                                            except:
-                                                sys.exit(127)
-                                            else:
-                                                sys.exit(0)
-                                else:
-                                    os.execvp(install_args[0], install_args)
-                        except Exception:
+                            os.execvp(install_args[0], install_args)
+                        except OSError:
+                            # This error may happen because the installer is run with elevated privileges
                             try:
-                                os.remove(filename)
-                            except:
-                                pass
-                    webbrowser.open(url, autoraise=True)
-                    if self.shutdown is True or (self.shutdown is not False and self.shutdown()):
-                        sys.exit(0)
-                else:
-                    self.config['skip_version'] = self.skipver = maxitem['ver']
-                    try:
-                        self.config.sync()
-                    except AttributeError:
-                        pass
+                                import win32com.client
+                            except (ModuleNotFoundError, ImportError):
+                                batch_handle, batch_filename = tempfile.mkstemp(suffix='.cmd')
+                                with os.fdopen(batch_handle, "w") as batch_file:
+                                    print('@echo off\nstart %*\n(goto) 2>nul & del "%~f0"', file=batch_file)
+                                os.execv(batch_filename, [batch_filename] + install_args)
+                            else:
+                                shell = win32com.client.Dispatch("WScript.Shell")
+                                try:
+                                    shell.Run(install)
+                                except:
+                                    sys.exit(127)
+                                else:
+                                    sys.exit(0)
+                    else:
+                        os.execvp(install_args[0], install_args)
+            except Exception:
+                pass
+        webbrowser.open(url, autoraise=True)
+        if self.shutdown is True or (self.shutdown is not False and self.shutdown()):
+            sys.exit(0)
+
+
+class _BackgroundProgress(object):
+    """
+    Progress of the background download. It throttles the download to the given rate and blocks it while
+    the download is paused.
+
+    :param rate: Maximum download rate in bytes per second or None for no limit.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.cancelled = False
+        self.start = None
+
+    def update(self, received, total):
+        if not self.resumed.is_set():
+            self.resumed.wait()
+            # do not catch up for the pause
+            self.start = None
+        if self.cancelled:
+            return False
+        now = time.time()
+        if self.start is None:
+            self.start = now, received
+        elif self.rate:
+            delay = self.start[0] + (received - self.start[1]) / float(self.rate) - now
+            if delay > 0:
+                time.sleep(delay)
+        return True
+
+    def close(self):
+        pass
+
+
+class _ThreadsafeProgress(object):
+    """
+    Download progress proxy passing updates from the download thread to the progress object in the event loop.
+    """
+
+    def __init__(self, loop, progress):
+        self.loop = loop
+        self.progress = progress
+        self.cancelled = False
+        self.pending = False
+
+    def update(self, received, total):
+        if not self.pending:
+            self.pending = True
+            self.loop.call_soon_threadsafe(self._update, received, total)
+        return not self.cancelled
+
+    def _update(self, received, total):
+        self.pending = False
+        if self.progress.update(received, total) is False:
+            self.cancelled = True
 
 
 __all__ = ['PySparkle']
@@ -0,0 +1,146 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+"""
+Command-line interface for unattended updates::
+
+    python -m pysparkle check|download|install URL [URL ...] --app-version VERSION [options]
+
+``check`` reports the newest available update, ``download`` downloads and verifies its installer, and ``install``
+downloads the installer and runs it. The headless frontend is used, so no GUI toolkit is imported. Unlike
+:meth:`PySparkle.install`, the command never falls back to opening the update link in the web browser.
+
+Exit status is 0 on success or if there is no update, 1 on errors, and 100 if ``check`` found an update.
+Run ``python -m pysparkle --help`` for the options.
+"""
+
+import os
+import sys
+import json
+import shlex
+import shelve
+import subprocess
+import logging
+import argparse
+
+from . import PySparkle
+from .backend import PySparkleError
+
+UPDATE_AVAILABLE = 100
+
+_MISSING = object()
+
+
+def _report(result, as_json):
+    if as_json:
+        print(json.dumps(result, sort_keys=True))
+    elif result['status'] == 'error':
+        print("Error: {}".format(result['message']), file=sys.stderr)
+    elif result['status'] == 'up-to-date':
+        print("{name} {current} is up to date".format(**result))
+    else:
+        print("{name} {version} is available (current version {current})".format(**result))
+        if 'file' in result:
+            print(result['file'])
+    sys.stdout.flush()
+
+
+def _restore(config, key, value):
+    if value is _MISSING:
+        config.pop(key, None)
+    else:
+        config[key] = value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysparkle', description="Check for updates and install them.")
+    parser.add_argument('command', choices=('check', 'download', 'install'), help="action to perform")
+    parser.add_argument('url', nargs='+',
+                        help="appcast URL; several mirrors of the same feed may be given in one argument, "
+                             "separated by spaces")
+    parser.add_argument('-a', '--app-version', required=True, help="current application version")
+    parser.add_argument('-n', '--app-name', default='Application', help="application name")
+    parser.add_argument('-c', '--config', help="file storing the configuration and state between runs")
+    parser.add_argument('-t', '--timeout', type=float, default=10., help="connection timeout in seconds")
+    parser.add_argument('--channel', action='append', help="additional update channel (may be repeated)")
+    parser.add_argument('-f', '--force', action='store_true', help="ignore the skipped version")
+    parser.add_argument('--ignore-rollout', action='store_true',
+                        help="find updates in phased rollout even if it has not reached this installation yet")
+    parser.add_argument('--install-command',
+                        help="installer command used instead of the one from the appcast; "
+                             "{file} is replaced with the installer file name")
+    parser.add_argument('--json', action='store_true', help="print the result as JSON")
+    parser.add_argument('-v', '--verbose', action='count', default=0, help="log more details")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=max(logging.DEBUG, logging.WARNING - 10 * args.verbose), stream=sys.stderr,
+                        format='%(levelname)s: %(message)s')
+
+    urls = [url.split() for url in args.url]
+    urls = [url[0] if len(url) == 1 else tuple(url) for url in urls]
+    config = shelve.open(args.config) if args.config else {}
+    # channels given in the command line apply to this run only
+    channels = config.get('channels', _MISSING)
+    try:
+        if args.channel:
+            config['channels'] = args.channel
+        pysparkle = PySparkle(urls if len(urls) > 1 else urls[0], args.app_name, args.app_version,
+                              frontend='headless', config=config, timeout=args.timeout, startup_check=False)
+        result = {'name': args.app_name, 'current': args.app_version}
+        try:
+            item = pysparkle.find_update(args.force, not args.ignore_rollout)
+            if item is None:
+                result['status'] = 'up-to-date'
+                _report(result, args.json)
+                return 0
+            result.update(status='available', version=item['version'], ver=item['ver'], url=item['url'],
+                          title=item.get('title'))
+            if args.command == 'check':
+                _report(result, args.json)
+                return UPDATE_AVAILABLE
+            if item['url'] is None:
+                raise PySparkleError("Update {} has no enclosure to download".format(item['version']))
+            command = args.install_command or item.get('install')
+            if args.command == 'install' and command is None:
+                raise PySparkleError("Update {} has no installer command".format(item['version']))
+            result['file'] = pysparkle.download(item)
+        except (PySparkleError, OSError, ValueError) as err:
+            _report({'status': 'error', 'message': str(err)}, args.json)
+            return 1
+        if args.command == 'download':
+            result['status'] = 'downloaded'
+            _report(result, args.json)
+            return 0
+        try:
+            install_args = shlex.split(command.format(file=result['file']))
+            if not install_args:
+                raise ValueError("Empty installer command")
+        except (ValueError, KeyError, IndexError) as err:
+            _report({'status': 'error', 'message': "Invalid installer command: {}".format(err)}, args.json)
+            return 1
+        result['status'] = 'installing'
+        _report(result, args.json)
+        if args.channel:
+            _restore(config, 'channels', channels)
+        try:
+            config.sync()
+        except AttributeError:
+            pass
+        try:
+            if os.name == 'nt':
+                return 0 if subprocess.call(install_args) == 0 else 1
+            # the installer replaces this process
+            os.execvp(install_args[0], install_args)
+        except OSError as err:
+            _report({'status': 'error', 'message': "Cannot run the installer: {}".format(err)}, args.json)
+            return 1
+    finally:
+        if args.channel:
+            _restore(config, 'channels', channels)
+        try:
+            config.close()
+        except AttributeError:
+            pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
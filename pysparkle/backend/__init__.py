@@ -1,12 +1,19 @@
 # Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
 # See LICENSE file for copyright information.
 
-try:
-    from urllib2 import urlopen, URLError, HTTPBasicAuthHandler, build_opener, install_opener
-except ImportError:
-    from urllib.request import urlopen, HTTPBasicAuthHandler, build_opener, install_opener
-    from urllib.error import URLError
+from urllib.request import Request, HTTPBasicAuthHandler, HTTPPasswordMgrWithPriorAuth
+from urllib.error import URLError, HTTPError
+import os
+import json
 import socket
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from email.utils import parsedate_tz, mktime_tz
+
+from .session import Session
+from .mirrors import MirrorSelector
+from . import compression
 
 import locale
 _,  _coding = locale.getdefaultlocale()
@@ -30,10 +37,49 @@ class PySparkleError(Exception):
 class ConnectionError(PySparkleError):
     """
     Error class raised when there is an internet connection error.
+
+    :param retry_after: Number of seconds after which the request may be retried, as requested by the server.
     """
 
-    def __init__(self, url, message):
+    def __init__(self, url, message, retry_after=None):
         super(ConnectionError, self).__init__(url + "\n\n" + message)
+        self.retry_after = retry_after
+
+
+def _retry_after(headers):
+    """
+    Parse ``Retry-After`` header.
+    :return: number of seconds or None if the header is absent or invalid
+    """
+    value = headers.get('Retry-After') if headers is not None else None
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        date = parsedate_tz(value)
+        return max(0, mktime_tz(date) - time.time()) if date is not None else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class DownloadCancelled(PySparkleError):
+    """
+    Error class raised when the user cancels the download.
+    """
+
+    def __init__(self, url):
+        super(DownloadCancelled, self).__init__(url + "\n\nDownload cancelled")
+
+
+class VerificationError(PySparkleError):
+    """
+    Error class raised when the downloaded file does not match its expected size, digest, or signature.
+    """
+
+    def __init__(self, url, message):
+        super(VerificationError, self).__init__(url + "\n\n" + message)
 
 
 class PySparkleBackend(object):
@@ -41,35 +87,373 @@ class PySparkleBackend(object):
     PySparkle backend base class. It is responsible for downloading update data. Subclasses should overwrite
     methods that parse it.
 
-    :param url: URL to download
+    All requests are made with the backend :attr:`session`, which keeps connections alive for reuse.
+    Authentication ('auth_user' and 'auth_password' in the config) and additional request headers
+    ('http_headers' dict in the config) apply only to this session and do not affect other urllib users
+    in the application. Basic auth credentials are sent pre-emptively with each request to the update URL.
+
+    :param url: URL to download or a list of URLs of several feeds (e.g. stable, beta, and nightly).
+                Each URL can be also given as a tuple of mirror URLs of the same feed.
     """
 
     def __init__(self, url, pysparkle):
-        self.url = url
+        if isinstance(url, (str, tuple)):
+            url = [url]
+        #: list of feeds, each given as a tuple of its mirror URLs
+        self.urls = [(feed,) if isinstance(feed, str) else tuple(feed) for feed in url]
+        self.url = self.urls[0][0]
         self.pysparkle = pysparkle
+        self._config_lock = threading.Lock()
+        handlers = []
         auth_user = pysparkle.config.get('auth_user')
         if auth_user is not None:
             auth_pass = pysparkle.config.get('auth_password', '')
-            auth_handler = HTTPBasicAuthHandler()
-            auth_handler.add_password(None, url, auth_user, auth_pass)
-            opener = build_opener(auth_handler)
-            install_opener(opener)
+            password_manager = HTTPPasswordMgrWithPriorAuth()
+            for mirrors in self.urls:
+                for feed_url in mirrors:
+                    password_manager.add_password(None, feed_url, auth_user, auth_pass, is_authenticated=True)
+            handlers.append(HTTPBasicAuthHandler(password_manager))
+        self.session = Session(*handlers, headers=pysparkle.config.get('http_headers'))
+        self.mirrors = MirrorSelector(self.session, pysparkle, self._config_lock)
 
     def check_update(self, get_notes):
         """
-        Download update info and parse its data.
+        Download update info from all the feeds and merge it.
+
+        Multiple feeds are fetched concurrently and their items are merged by version, so each version is
+        listed once, with the newest items first. Items marked with a channel (e.g. ``sparkle:channel``) are
+        only included if the channel is listed in ``channels`` in the config. An error is raised only if
+        all the feeds fail.
+
+        :param get_notes: Flag indicating if release notes should be retrieved.
+        :return: list of items
+        """
+        if len(self.urls) == 1:
+            feeds = [self.check_feed(self.urls[0], get_notes)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(self.urls)) as executor:
+                futures = [executor.submit(self.check_feed, url, get_notes) for url in self.urls]
+            feeds = []
+            errors = []
+            for future in futures:
+                try:
+                    feeds.append(future.result())
+                except Exception as err:
+                    errors.append(err)
+            if errors and not feeds:
+                raise errors[0]
+        feeds = [feed for feed in feeds if feed is not None]
+        if not feeds:
+            return None
+        channels = self.pysparkle.config.get('channels', ())
+        index = {}
+        for feed in feeds:
+            for item in feed:
+                channel = item.get('channel')
+                if channel is not None and channel not in channels:
+                    continue
+                index.setdefault(item['key'], item)
+        return [index[key] for key in sorted(index, reverse=True)]
+
+    def check_feed(self, url, get_notes):
+        """
+        Download update info of a single feed and parse its data.
 
+        Compressed transfer is negotiated with the server and the data is decompressed while it is being parsed.
+        Gzip compressed update files (e.g. ``appcast.xml.gz``) are supported as well.
+
+        The parsed data is stored in the config together with the ``ETag`` and ``Last-Modified`` headers
+        of the response. On subsequent checks a conditional request is sent and, if the server responds
+        with ``304 Not Modified``, the stored data is returned without downloading and parsing it again.
+
+        If the feed has several mirrors, the first one to respond is used (see
+        :class:`~pysparkle.backend.mirrors.MirrorSelector`). The parsed data is stored under the first mirror URL.
+
+        :param url: Feed URL or a tuple of its mirror URLs.
         :param get_notes: Flag indicating if release notes should be retrieved.
         """
+        mirrors = (url,) if isinstance(url, str) else url
+        url = mirrors[0]
+        config = self.pysparkle.config
+        cached = config.get('update_cache', {}).get(url)
+        if cached is not None and (get_notes and not cached['notes'] or
+                                   cached.get('scheme') != self.pysparkle.version_scheme):
+            cached = None
+        headers = {'Accept-Encoding': compression.ACCEPT_ENCODING}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        try:
+            url, handler = self.mirrors.open(mirrors, headers)
+        except HTTPError as err:
+            err.close()
+            if err.code == 304 and cached is not None:
+                return cached['items']
+            raise ConnectionError(url, str(err), _retry_after(err.headers))
+        except (URLError, socket.timeout) as err:
+            raise ConnectionError(url, str(err))
+        else:
+            with handler:
+                items = self.parse_update_data(compression.decompress(handler), get_notes)
+            etag = handler.headers.get('ETag')
+            last_modified = handler.headers.get('Last-Modified')
+            if items is not None and (etag or last_modified):
+                with self._config_lock:
+                    cache = dict(config.get('update_cache', {}))
+                    cache[mirrors[0]] = {'etag': etag, 'last_modified': last_modified, 'notes': get_notes,
+                                         'scheme': self.pysparkle.version_scheme, 'items': items}
+                    config['update_cache'] = cache
+                    try:
+                        config.sync()
+                    except AttributeError:
+                        pass
+            return items
 
+    def download(self, url, filename, progress=None, chunk_size=65536, verifier=None, length=None, segments=None):
+        """
+        Download file in chunks. Data is written to the file with ``.part`` suffix, which is renamed to the
+        target name once the download is complete. If such partial file exists from an interrupted download,
+        the download is resumed using an HTTP Range request.
+
+        If 'download_segments' in the config is larger than 1, the file is split into that many ranges, which
+        are downloaded concurrently over separate connections (see :meth:`download_segmented`). This is done
+        only if the server accepts range requests; otherwise the file is downloaded in a single stream.
+
+        :param url: URL to download or a tuple of its mirror URLs. The file is downloaded from the first mirror
+                    to respond (see :class:`~pysparkle.backend.mirrors.MirrorSelector`).
+        :param filename: Name of the target file.
+        :param progress: Callable called after each chunk with the number of received bytes and the total size
+                         (or None if unknown). If it returns False, the download is cancelled, leaving the partial
+                         file, and :class:`DownloadCancelled` is raised.
+        :param chunk_size: Size of the read chunks.
+        :param verifier: :class:`~pysparkle.backend.verify.Verifier` fed with the data while it is downloaded.
+                         If the verification fails, the partial file is removed and :class:`VerificationError`
+                         is raised.
+        :param length: Expected file size, e.g. from the appcast.
+        :param segments: Number of concurrent connections. By default 'download_segments' from the config is used.
+        :return: downloaded file name
+        """
+        mirrors = (url,) if isinstance(url, str) else tuple(url)
+        url = mirrors[0]
+        partname = filename + '.part'
+        if segments is None:
+            segments = self.pysparkle.config.get('download_segments', 1)
+        if segments > 1 and (not os.path.exists(partname) or os.path.exists(filename + '.segments')):
+            if self.download_segmented(mirrors, filename, segments, progress, chunk_size, verifier, length):
+                return filename
+        elif os.path.exists(filename + '.segments'):
+            # partial file of a segmented download is not contiguous, so it cannot be resumed in a single stream
+            for name in (partname, filename + '.segments'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
         try:
-            handler = urlopen(self.url, timeout=self.pysparkle.timeout)
+            offset = os.path.getsize(partname)
+        except OSError:
+            offset = 0
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            url, handler = self.mirrors.open(mirrors, headers)
+        except HTTPError as err:
+            err.close()
+            if err.code == 416 and offset:
+                # partial file is not valid for this resource
+                os.remove(partname)
+                return self.download(mirrors, filename, progress, chunk_size, verifier, length, segments)
+            raise ConnectionError(url, str(err))
         except (URLError, socket.timeout) as err:
-            raise ConnectionError(self.url, str(err))
+            raise ConnectionError(url, str(err))
+        with handler:
+            total = None
+            if offset:
+                content_range = handler.headers.get('Content-Range', '')
+                if handler.getcode() == 206 and content_range.startswith('bytes {}-'.format(offset)):
+                    total = content_range.rpartition('/')[2]
+                    total = int(total) if total.isdigit() else None
+                else:
+                    # server does not support ranges
+                    offset = 0
+            if total is None:
+                length = handler.headers.get('Content-Length')
+                if length is not None:
+                    total = offset + int(length)
+            received = offset
+            if offset and verifier is not None:
+                with open(partname, 'rb') as partial:
+                    for chunk in iter(lambda: partial.read(chunk_size), b''):
+                        verifier.update(chunk)
+            with open(partname, 'ab' if offset else 'wb') as output:
+                if progress is not None and progress(received, total) is False:
+                    raise DownloadCancelled(url)
+                while True:
+                    try:
+                        chunk = handler.read(chunk_size)
+                    except (socket.timeout, OSError) as err:
+                        raise ConnectionError(url, str(err))
+                    if not chunk:
+                        break
+                    output.write(chunk)
+                    if verifier is not None:
+                        verifier.update(chunk)
+                    received += len(chunk)
+                    if progress is not None and progress(received, total) is False:
+                        raise DownloadCancelled(url)
+        if total is not None and received != total:
+            raise ConnectionError(url, "Received {} bytes out of {}".format(received, total))
+        if verifier is not None:
+            try:
+                verifier.verify(received)
+            except VerificationError:
+                os.remove(partname)
+                raise
+        os.replace(partname, filename)
+        return filename
+
+    def download_segmented(self, url, filename, segments, progress=None, chunk_size=65536, verifier=None,
+                           length=None):
+        """
+        Download file in several ranges concurrently. Each range is fetched over its own connection and written
+        at its offset to the preallocated ``.part`` file. Segments are not smaller than 'download_segment_size'
+        in the config (1 MiB by default). Progress of the interrupted download is kept in a ``.segments`` file,
+        so it can be resumed. The complete file is verified before it is renamed to the target name.
+
+        The file size is taken from the ``HEAD`` response or from `length` if the server does not send it.
+        If the ``HEAD`` request fails, the server is assumed not to accept range requests. If there are several
+        mirrors, all the segments are downloaded from the one that responds first.
+
+        Arguments are the same as for :meth:`download`.
+
+        :param segments: Maximum number of concurrent connections.
+        :return: True if the file has been downloaded or False if the server does not accept range requests
+                 and the file should be downloaded in a single stream
+        """
+        mirrors = (url,) if isinstance(url, str) else tuple(url)
+        url = mirrors[0]
+        partname = filename + '.part'
+        statename = filename + '.segments'
+        try:
+            source, handler = self.mirrors.open(mirrors, method='HEAD')
+        except HTTPError as err:
+            # many servers reject HEAD requests, so the file is downloaded in a single stream
+            err.close()
+            accept_ranges, total = '', None
+        except (URLError, socket.timeout, OSError):
+            accept_ranges, total = '', None
         else:
-            # print(handler.getcode())
-            # print(handler.headers.getheader('content-type'))
-            return self.parse_update_data(handler, get_notes)
+            with handler:
+                handler.read()
+                accept_ranges = handler.headers.get('Accept-Ranges', '').strip().lower()
+                total = handler.headers.get('Content-Length')
+        total = int(total) if total is not None and total.isdigit() else int(length or 0)
+
+        state = None
+        try:
+            with open(statename) as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError):
+            pass
+        if state is not None and (state.get('url') != url or state.get('total') != total or
+                                  accept_ranges != 'bytes'):
+            # partial file of a segmented download is not contiguous, so it cannot be resumed otherwise
+            for name in (partname, statename):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            state = None
+        if accept_ranges != 'bytes' or not total:
+            return False
+        if state is None or not os.path.exists(partname):
+            min_size = self.pysparkle.config.get('download_segment_size', 1048576)
+            segments = max(1, min(segments, total // min_size))
+            if segments == 1:
+                return False
+            size = -(-total // segments)
+            # each segment is a list of its current position and end offset
+            state = {'url': url, 'total': total,
+                     'segments': [[start, min(start + size, total)] for start in range(0, total, size)]}
+            with open(partname, 'wb') as output:
+                output.truncate(total)
+
+        ranges = [segment for segment in state['segments'] if segment[0] < segment[1]]
+        received = [total - sum(end - start for start, end in ranges)]
+        lock = threading.Lock()
+        cancelled = threading.Event()
+        fd = os.open(partname, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+
+        def write(data, offset):
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fd, data, offset)
+            else:
+                with lock:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    os.write(fd, data)
+
+        def fetch(segment):
+            request = Request(source)
+            request.add_header('Range', 'bytes={}-{}'.format(segment[0], segment[1] - 1))
+            try:
+                handler = self.session.open(request, timeout=self.pysparkle.timeout)
+            except HTTPError as err:
+                err.close()
+                raise ConnectionError(url, str(err))
+            except (URLError, socket.timeout) as err:
+                raise ConnectionError(url, str(err))
+            with handler:
+                if handler.getcode() != 206 or \
+                        not handler.headers.get('Content-Range', '').startswith('bytes {}-'.format(segment[0])):
+                    raise ConnectionError(url, "Server does not support range requests")
+                while segment[0] < segment[1] and not cancelled.is_set():
+                    try:
+                        chunk = handler.read(min(chunk_size, segment[1] - segment[0]))
+                    except (socket.timeout, OSError) as err:
+                        raise ConnectionError(url, str(err))
+                    if not chunk:
+                        raise ConnectionError(url, "Connection closed before the end of range")
+                    write(chunk, segment[0])
+                    with lock:
+                        segment[0] += len(chunk)
+                        received[0] += len(chunk)
+
+        executor = ThreadPoolExecutor(max_workers=len(ranges) or 1)
+        try:
+            futures = [executor.submit(fetch, segment) for segment in ranges]
+            not_done = futures
+            while not_done:
+                done, not_done = wait(not_done, timeout=0.1, return_when=FIRST_EXCEPTION)
+                if progress is not None and progress(received[0], total) is False:
+                    raise DownloadCancelled(url)
+                for future in done:
+                    future.result()
+        except:
+            cancelled.set()
+            executor.shutdown(wait=True)
+            os.close(fd)
+            with open(statename, 'w') as state_file:
+                json.dump(state, state_file)
+            raise
+        executor.shutdown(wait=True)
+        os.close(fd)
+        try:
+            os.remove(statename)
+        except OSError:
+            pass
+        if verifier is not None:
+            with open(partname, 'rb') as partial:
+                for chunk in iter(lambda: partial.read(chunk_size), b''):
+                    verifier.update(chunk)
+            try:
+                verifier.verify(total)
+            except VerificationError:
+                os.remove(partname)
+                raise
+        os.replace(partname, filename)
+        return True
 
     def parse_update_data(self, handler, get_notes):
         """
@@ -2,6 +2,7 @@
 # See LICENSE file for copyright information.
 
 import sys
+import os
 
 try:
     from xml.etree import cElementTree as ElementTree
@@ -9,33 +10,183 @@ except ImportError:
     from xml.etree import ElementTree
 NS = '{http://www.andymatuschak.org/xml-namespaces/sparkle}'
 
-try:
-    from urllib2 import urlopen
-except ImportError:
-    from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor, wait
+from email.utils import parsedate_tz, mktime_tz
+
+from ..version import version_key
+from .item import AppcastItem, Enclosure
 
 
 import platform
-OS, _, _, _, ARCH, _ = platform.uname()
-OS = OS.lower()
-ARCH = ARCH.lower()
-ARCH = {'amd64': 'x86_64'}.get(ARCH, ARCH)
-if OS == 'linux':
+
+_os_arch = None
+_dists = None
+
+
+def _linux_distribution():
     from .. import distro
-    _dist, _dist_ver, _dist_id = (s.lower() for s in distro.linux_distribution(False))
-    DISTS = [_dist]
-    _dist += '-'
-    _parts = _dist_ver.split('.')
-    _partial_ver = _dist + _parts[0]
-    DISTS.append(_partial_ver)
-    for _part in _parts[1:]:
-        _partial_ver = '.'.join((_partial_ver, _part))
-        DISTS.append(_partial_ver)
-    if _dist_id:
-        DISTS.append(_dist+_dist_id)
-else:
-    python_version = '{}.{}'.format(sys.version_info.major, sys.version_info.minor)
-    DISTS = ['py'+python_version, 'python-'+python_version]
+    # os-release file is normally sufficient, so try not to spawn lsb_release command
+    dist = distro.LinuxDistribution(include_lsb=False, include_uname=False)
+    if not (dist.id() and dist.version()):
+        dist = distro.LinuxDistribution(include_uname=False)
+    return dist.linux_distribution(False)
+
+
+def get_os_arch():
+    """
+    Get the current operating system and architecture names. They are detected on the first call.
+
+    :return: tuple of lowercase os and architecture names
+    """
+    global _os_arch
+    if _os_arch is None:
+        uname = platform.uname()
+        os_name, arch = uname[0].lower(), uname[4].lower()
+        _os_arch = os_name, {'amd64': 'x86_64'}.get(arch, arch)
+    return _os_arch
+
+
+def _platform_key():
+    """
+    Key for the platform cache. It changes when the os-release file is modified or the kernel is upgraded.
+    """
+    try:
+        mtime = os.stat(os.path.join(os.environ.get('UNIXCONFDIR', '/etc'), 'os-release')).st_mtime
+    except OSError:
+        mtime = None
+    os_name, arch = get_os_arch()
+    return [os_name, arch, platform.uname()[2], mtime]
+
+
+def get_dists(config=None):
+    """
+    Get the list of distribution names matching the current system. On Linux these are the distribution id
+    followed by its partial versions and codename; on other systems they are Python versions.
+    The distribution is detected on the first call only.
+
+    :param config: PySparkle config dict. If given, the detected Linux distribution is stored in it under
+                   the 'platform' key and reused in subsequent runs, until the os-release file or the kernel
+                   release changes.
+    :return: list of distribution names
+    """
+    global _dists
+    if _dists is None:
+        if get_os_arch()[0] == 'linux':
+            key = _platform_key()
+            if config is not None:
+                cached = config.get('platform')
+                if cached is not None and list(cached.get('key', ())) == key:
+                    _dists = list(cached['dists'])
+                    return _dists
+            dist, dist_ver, dist_id = (s.lower() for s in _linux_distribution())
+            dists = [dist]
+            dist += '-'
+            parts = dist_ver.split('.')
+            partial_ver = dist + parts[0]
+            dists.append(partial_ver)
+            for part in parts[1:]:
+                partial_ver = '.'.join((partial_ver, part))
+                dists.append(partial_ver)
+            if dist_id:
+                dists.append(dist+dist_id)
+            if config is not None:
+                config['platform'] = {'key': key, 'dists': dists}
+                try:
+                    config.sync()
+                except AttributeError:
+                    pass
+        else:
+            python_version = '{}.{}'.format(sys.version_info.major, sys.version_info.minor)
+            dists = ['py'+python_version, 'python-'+python_version]
+        _dists = dists
+    return _dists
+
+
+_ARCH_ALIASES = {'x86_64': ('x64',), 'i386': ('x86',)}
+
+
+class PlatformMatcher(object):
+    """
+    Table for matching enclosures to the current platform, compiled once from the os, architecture
+    and distribution names.
+
+    Each enclosure gets a rank: generic enclosures (without ``sparkle:os``) have rank 0, enclosures for
+    the current os have rank 1 and specifying the matching architecture adds 1. Matching ``sparkle:dist``
+    adds 2 times the position of the distribution in the dists list, so the most specific distribution
+    version is preferred. Enclosures for other platforms have rank -1.
+
+    :param os_name: Operating system name.
+    :param arch: Architecture name.
+    :param dists: List of distribution names, from the most generic to the most specific one, or a function
+                  returning it. The function is called only when an enclosure with ``sparkle:dist`` is ranked.
+    """
+
+    def __init__(self, os_name, arch, dists):
+        self.os = os_name
+        self.arch = arch
+        self._dists = dists
+        self._dist_ranks = None
+        self.os_ranks = {None: 0, os_name: 1}
+        for name in (arch,) + _ARCH_ALIASES.get(arch, ()):
+            self.os_ranks[os_name + '-' + name] = 2
+
+    @property
+    def dists(self):
+        if callable(self._dists):
+            self._dists = self._dists()
+        return tuple(self._dists)
+
+    @property
+    def dist_ranks(self):
+        if self._dist_ranks is None:
+            dist_ranks = dict((dist, 2 * (i + 1)) for i, dist in enumerate(self.dists))
+            dist_ranks[None] = 0
+            self._dist_ranks = dist_ranks
+        return self._dist_ranks
+
+    def rank(self, os, dist=None):
+        """
+        Compute rank of an enclosure.
+
+        :param os: Value of the ``sparkle:os`` attribute or None.
+        :param dist: Value of the ``sparkle:dist`` attribute or None.
+        :return: enclosure rank; higher is better and negative means that the enclosure does not match
+        """
+        os_rank = self.os_ranks.get(os, -1)
+        if os_rank < 0:
+            return -1
+        dist_rank = 0 if dist is None else self.dist_ranks.get(dist, -1)
+        if dist_rank < 0:
+            return -1
+        return os_rank + dist_rank
+
+
+_matcher = None
+
+
+def get_matcher(config=None):
+    """
+    Get the platform matcher for the current system. It is created on the first call.
+
+    :param config: PySparkle config dict used for caching distribution detection (see :func:`get_dists`).
+    :return: :class:`PlatformMatcher` object
+    """
+    global _matcher
+    if _matcher is None:
+        os_name, arch = get_os_arch()
+        _matcher = PlatformMatcher(os_name, arch, lambda: get_dists(config))
+    return _matcher
+
+
+def __getattr__(name):
+    # OS, ARCH, and DISTS are computed lazily, as distribution detection may be expensive
+    if name == 'OS':
+        return get_os_arch()[0]
+    elif name == 'ARCH':
+        return get_os_arch()[1]
+    elif name == 'DISTS':
+        return get_dists()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 from . import PySparkleBackend
@@ -49,75 +200,163 @@ class Appcast(PySparkleBackend):
     """
 
     def parse_update_data(self, handler, get_notes):
-        tree = ElementTree.parse(handler)
-        rss = tree.getroot()
+        """
+        Parse the appcast. The XML is parsed incrementally and every item is discarded as soon as it is
+        processed, so the memory use does not depend on the appcast size.
+
+        If ``appcast_sorted`` is set in the config, the appcast items are assumed to be sorted from the newest
+        one. Then the parsing stops at the first item that is not newer than the current application version.
+
+        Release notes links are downloaded after parsing, only for items newer than the current version.
+        """
+        appkey = self.pysparkle.appkey
+        sorted_feed = self.pysparkle.config.get('appcast_sorted')
         items = []
-        for channel in rss.iter('channel'):
-            for item in channel.findall('item'):
-                info = {'title': item.findtext('title', '')}
-                if get_notes:
-                    notes = item.findtext('description')
-                    if notes is None:
-                        notes = ''
-                        notes_link = item.findtext(NS+'releaseNotesLink')
-                        if notes_link is not None:
-                            try: notes = urlopen(notes_link, timeout=self.pysparkle.timeout).read()
-                            except: pass
-                    info['notes'] = notes.strip()
-                enclosures = item.findall('enclosure')
-                if enclosures:
-                    os_matched = False
-                    for enclosure in enclosures:
-                        try:
-                            encl = {
-                                'url': enclosure.attrib['url'],
-                                'ver': enclosure.attrib[NS+'version'],
-                                'signature': enclosure.attrib.get(NS+'dsaSignature'),
-                                'length': enclosure.attrib.get('length', 0),
-                                'install': enclosure.attrib.get(NS+'install', 0)
-                            }
-                            encl['version'] = enclosure.attrib.get(NS+'shortVersionString', encl['ver'])
-                            os = enclosure.attrib.get(NS+'os')
-                            if os is not None:
-                                try:
-                                    os, arch = os.split('-')
-                                except TypeError:
-                                    if os_matched:
-                                        # prefer enclosure with specified os and arch over a generic one
-                                        continue
-                                else:
-                                    arch = {'x64': 'x86_64', 'x86': 'i386'}.get(arch, arch)
-                                    if arch != ARCH:
-                                        raise ValueError('arch='+arch)
-                                if os != OS:
-                                    raise ValueError('os='+os)
-                                dist = enclosure.attrib.get(NS+'dist')
-                                if dist is not None:
-                                    if dist not in DISTS:
-                                        raise ValueError('dist='+dist)
-                                elif os_matched:
-                                    # prefer enclosure with specified dist over a generic one
-                                    continue
-                                os_matched = True
-                            elif os_matched:
-                                # prefer enclosure with specified os over a generic one
-                                continue
-                        except (KeyError, ValueError):
-                            continue
-                        else:
-                            info.update(encl)
-                if 'url' not in info:
-                    # did not find proper enclosure
-                    link = item.findtext('link')
-                    ver = item.findtext(NS+'version')
-                    if link is not None and ver is not None:
-                        info['link'] = link
-                        info['ver'] = ver
-                        info['url'] = None
-                        info['version'] = item.findtext(NS+'shortVersionString', info['ver'])
-                    else:
-                        continue
-                if 'ver' in info:
+        stack = []
+        for event, elem in ElementTree.iterparse(handler, ('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag == 'item' and stack and stack[-1].tag == 'channel':
+                info = self.parse_item(elem, get_notes)
+                stack[-1].remove(elem)
+                if info is not None:
                     items.append(info)
-
+                    if sorted_feed and info['key'] <= appkey:
+                        break
+        if get_notes:
+            self.fetch_notes([item for item in items
+                              if item.get('notes_link') is not None and item['key'] > appkey])
         return items
+
+    def fetch_notes(self, items):
+        """
+        Download release notes from ``sparkle:releaseNotesLink`` of the given items concurrently.
+
+        The number of simultaneous downloads is limited by ``notes_workers`` in the config (4 by default).
+        PySparkle ``timeout`` is the deadline for all the downloads together: notes that are not
+        retrieved by then are left empty.
+
+        :param items: List of parsed items with 'notes_link' key. Their 'notes' are updated in place.
+        """
+        if not items:
+            return
+        executor = ThreadPoolExecutor(max_workers=self.pysparkle.config.get('notes_workers', 4))
+        futures = dict((executor.submit(self._read_notes, item['notes_link']), item) for item in items)
+        done, not_done = wait(futures, timeout=self.pysparkle.timeout)
+        for future in not_done:
+            future.cancel()
+        executor.shutdown(wait=False)
+        for future in done:
+            try:
+                futures[future]['notes'] = future.result().strip()
+            except Exception:
+                pass
+
+    def _read_notes(self, url):
+        handler = self.session.open(url, timeout=self.pysparkle.timeout)
+        with handler:
+            charset = handler.headers.get_content_charset() or 'utf-8'
+            return handler.read().decode(charset, 'replace')
+
+    def parse_item(self, item, get_notes):
+        """
+        Parse a single appcast item.
+
+        :param item: ElementTree element with the item
+        :param get_notes: Flag indicating if release notes should be retrieved.
+        :return: :class:`~pysparkle.backend.item.AppcastItem` or None if the item does not contain any suitable
+                 enclosure or link. Item version key is stored in it under 'key' and the rank of the chosen
+                 enclosure (see :class:`PlatformMatcher`) under 'rank'.
+        """
+        info = AppcastItem(title=item.findtext('title', ''))
+        channel = item.findtext(NS+'channel')
+        if channel is not None:
+            info.channel = sys.intern(channel.strip())
+        if get_notes:
+            notes = item.findtext('description')
+            if notes is None:
+                # release notes link is downloaded later by fetch_notes
+                notes = ''
+                info.notes_link = item.findtext(NS+'releaseNotesLink')
+            info.notes = notes.strip()
+        enclosures = item.findall('enclosure')
+        if enclosures:
+            matcher = get_matcher(self.pysparkle.config)
+            chosen, chosen_rank = None, -1
+            for enclosure in enclosures:
+                attrib = enclosure.attrib
+                if 'url' not in attrib or NS+'version' not in attrib:
+                    continue
+                rank = matcher.rank(attrib.get(NS+'os'), attrib.get(NS+'dist'))
+                if rank > chosen_rank:
+                    chosen, chosen_rank = attrib, rank
+            if chosen is not None:
+                self._read_enclosure(chosen, info)
+                info.rank = chosen_rank
+                delta = self.parse_delta(item, info.os)
+                if delta is not None:
+                    info.delta = delta
+        if 'url' not in info:
+            # did not find proper enclosure
+            link = item.findtext('link')
+            ver = item.findtext(NS+'version')
+            if link is not None and ver is not None:
+                info.link = link
+                info.ver = ver
+                info.url = None
+                info.version = item.findtext(NS+'shortVersionString', ver)
+            else:
+                return None
+        info.key = version_key(info.ver, self.pysparkle.version_scheme)
+        interval = item.findtext(NS+'phasedRolloutInterval')
+        if interval is not None and interval.strip().isdigit():
+            # publication date is needed only for phased rollout
+            pub_date = parsedate_tz(item.findtext('pubDate', ''))
+            if pub_date is not None:
+                info.rollout_interval = int(interval)
+                info.pub_date = mktime_tz(pub_date)
+        return info
+
+    @staticmethod
+    def _read_enclosure(attrib, enclosure):
+        os = attrib.get(NS+'os')
+        enclosure.url = attrib['url']
+        enclosure.ver = attrib[NS+'version']
+        enclosure.version = attrib.get(NS+'shortVersionString', enclosure.ver)
+        enclosure.signature = attrib.get(NS+'dsaSignature')
+        enclosure.ed_signature = attrib.get(NS+'edSignature')
+        enclosure.digest = attrib.get(NS+'digest')
+        enclosure.length = int(attrib.get('length') or 0)
+        enclosure.install = attrib.get(NS+'install')
+        enclosure.os = sys.intern(os) if os is not None else None
+        mirrors = attrib.get(NS+'mirrors')
+        if mirrors:
+            enclosure.mirrors = (enclosure.url,) + tuple(mirrors.split())
+        return enclosure
+
+    def parse_delta(self, item, os):
+        """
+        Find the delta update from the current application version in the ``sparkle:deltas`` element of the item.
+
+        :param item: ElementTree element with the item.
+        :param os: Value of ``sparkle:os`` attribute of the selected full enclosure.
+        :return: :class:`~pysparkle.backend.item.Enclosure` with the delta or None if there is no matching delta
+        """
+        deltas = item.find(NS+'deltas')
+        if deltas is None:
+            return None
+        for enclosure in deltas.findall('enclosure'):
+            attrib = enclosure.attrib
+            delta_from = attrib.get(NS+'deltaFrom')
+            if delta_from is None or 'url' not in attrib or attrib.get(NS+'os') != os:
+                continue
+            if version_key(delta_from, self.pysparkle.version_scheme) == self.pysparkle.appkey:
+                delta = Enclosure(url=attrib['url'], delta_from=delta_from,
+                                  signature=attrib.get(NS+'dsaSignature'), ed_signature=attrib.get(NS+'edSignature'),
+                                  digest=attrib.get(NS+'digest'), length=int(attrib.get('length') or 0))
+                mirrors = attrib.get(NS+'mirrors')
+                if mirrors:
+                    delta.mirrors = (delta.url,) + tuple(mirrors.split())
+                return delta
@@ -0,0 +1,211 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import os
+import json
+import hashlib
+import shutil
+import getpass
+import tempfile
+import stat
+
+from . import VerificationError
+
+
+def _user_id():
+    if hasattr(os, 'getuid'):
+        return str(os.getuid())
+    try:
+        return getpass.getuser()
+    except Exception:
+        return 'default'
+
+
+class DownloadCache(object):
+    """
+    Cache of downloaded update files.
+
+    Each file is stored in a subdirectory named after a hash of the enclosure URL, version, length, and digest,
+    so a file is reused only for exactly the same enclosure. Only completely downloaded and verified files
+    are stored under their final names and registered in the entry metadata. Least recently used entries are
+    removed once the total cache size exceeds the limit.
+
+    The cache directory is created accessible only by the current user. On POSIX systems an existing directory
+    owned by another user or accessible by others is not used; a new private temporary directory is used instead.
+
+    :param directory: Cache directory. If None, ``pysparkle-cache-<user>`` in the system temporary directory
+                      is used.
+    :param max_size: Maximum total size of the cached files in bytes.
+    """
+
+    META = 'meta.json'
+
+    def __init__(self, directory=None, max_size=2**30):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'pysparkle-cache-' + _user_id())
+        self.directory = directory
+        self.max_size = max_size
+        self._checked = False
+        # size and modification time of the files verified in this process
+        self._verified = {}
+
+    def _check_directory(self):
+        """
+        Create the cache directory or make sure the existing one is private.
+        """
+        if self._checked:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        if hasattr(os, 'getuid'):
+            info = os.lstat(self.directory)
+            if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+                self.directory = tempfile.mkdtemp(prefix='pysparkle-cache-')
+        self._checked = True
+
+    @staticmethod
+    def key(item):
+        """
+        Compute cache key of the item.
+
+        :param item: Update item.
+        :return: hex string identifying the item enclosure
+        """
+        data = '\n'.join(str(item.get(k) or '') for k in ('url', 'ver', 'length', 'digest'))
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+    def filename(self, item):
+        """
+        Get the name of the cached file for the item. Its directory is created if necessary.
+        The file itself may not exist yet.
+
+        :param item: Update item.
+        :return: file name
+        """
+        self._check_directory()
+        directory = os.path.join(self.directory, self.key(item))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        return os.path.join(directory, os.path.basename(item['url']))
+
+    def get(self, item, verifier=None, chunk_size=65536):
+        """
+        Get the cached file for the item and mark it as recently used. Only files registered with :meth:`add`
+        are returned.
+
+        :param item: Update item.
+        :param verifier: :class:`~pysparkle.backend.verify.Verifier` of the item. If given, the cached file is
+                         verified again and removed from the cache if the verification fails. Files added
+                         by this process are not verified again if their size and modification time
+                         have not changed.
+        :param chunk_size: Size of the chunks read for verification.
+        :return: file name or None if the file is not in the cache
+        """
+        self._check_directory()
+        directory = os.path.join(self.directory, self.key(item))
+        filename = os.path.join(directory, os.path.basename(item['url']))
+        try:
+            with open(os.path.join(directory, self.META)) as meta:
+                meta = json.load(meta)
+            size = os.path.getsize(filename)
+        except (OSError, ValueError):
+            return None
+        if not meta.get('verified') or meta.get('url') != item['url'] or meta.get('ver') != item['ver']:
+            return None
+        length = int(item.get('length') or 0)
+        if length and size != length:
+            return None
+        verified = self._verified.get(filename) == self._signature(filename)
+        if verifier is not None and not verified:
+            try:
+                with open(filename, 'rb') as cached:
+                    for chunk in iter(lambda: cached.read(chunk_size), b''):
+                        verifier.update(chunk)
+                verifier.verify(size)
+            except (OSError, VerificationError):
+                shutil.rmtree(directory, ignore_errors=True)
+                return None
+            verified = True
+        os.utime(filename, None)
+        if verified:
+            self._verified[filename] = self._signature(filename)
+        return filename
+
+    @staticmethod
+    def _signature(filename):
+        try:
+            info = os.stat(filename)
+        except OSError:
+            return None
+        return info.st_size, info.st_mtime_ns
+
+    def add(self, item):
+        """
+        Register the downloaded file of the item, so it can be found by its version.
+
+        :param item: Update item, whose file has been stored at :meth:`filename` and verified.
+        """
+        directory = os.path.join(self.directory, self.key(item))
+        with open(os.path.join(directory, self.META), 'w') as meta:
+            json.dump({'url': item['url'], 'ver': item['ver'], 'verified': True}, meta)
+        filename = os.path.join(directory, os.path.basename(item['url']))
+        self._verified[filename] = self._signature(filename)
+
+    def find(self, ver):
+        """
+        Find a cached file by its version. This is used for finding the old file for delta updates.
+
+        :param ver: Version string.
+        :return: file name or None if there is no file for this version in the cache
+        """
+        self._check_directory()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return None
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name, self.META)) as meta:
+                    meta = json.load(meta)
+            except (OSError, ValueError):
+                continue
+            if meta.get('verified') and meta.get('ver') == ver:
+                filename = os.path.join(self.directory, name, os.path.basename(meta['url']))
+                if os.path.isfile(filename):
+                    return filename
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache size does not exceed the limit.
+
+        :param keep: Item, whose entry must not be removed.
+        """
+        self._check_directory()
+        keep = self.key(keep) if keep is not None else None
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            directory = os.path.join(self.directory, name)
+            if not os.path.isdir(directory):
+                continue
+            size = mtime = 0
+            try:
+                for filename in os.listdir(directory):
+                    stat = os.stat(os.path.join(directory, filename))
+                    size += stat.st_size
+                    mtime = max(mtime, stat.st_mtime)
+            except OSError:
+                continue
+            total += size
+            if name != keep:
+                entries.append((mtime, size, directory))
+        entries.sort()
+        for mtime, size, directory in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
@@ -0,0 +1,103 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import io
+import zlib
+
+
+class _Decompressor(object):
+    """
+    Adapter for decompressors without ``flush`` method.
+    """
+
+    def __init__(self, decompress):
+        self.decompress = decompress
+
+    def flush(self):
+        return b''
+
+
+DECOMPRESSORS = {
+    'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'x-gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'deflate': lambda: zlib.decompressobj(),
+}
+
+try:
+    import brotli
+except ImportError:
+    pass
+else:
+    DECOMPRESSORS['br'] = lambda: _Decompressor(brotli.Decompressor().process)
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        DECOMPRESSORS['zstd'] = lambda: zstandard.ZstdDecompressor().decompressobj()
+else:
+    DECOMPRESSORS['zstd'] = lambda: _Decompressor(zstd.ZstdDecompressor().decompress)
+
+#: Value of the Accept-Encoding header listing all supported encodings
+ACCEPT_ENCODING = ', '.join(encoding for encoding in DECOMPRESSORS if not encoding.startswith('x-'))
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class _DecompressingReader(io.RawIOBase):
+
+    def __init__(self, raw, decompressor=None, chunk_size=65536):
+        self.raw = raw
+        self.decompressor = decompressor
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer and not self.eof:
+            chunk = self.raw.read(self.chunk_size)
+            if self.decompressor is None:
+                self.buffer = chunk
+                self.eof = not chunk
+            elif chunk:
+                self.buffer = self.decompressor.decompress(chunk)
+            else:
+                self.buffer = self.decompressor.flush()
+                self.eof = True
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+def decompress(handler):
+    """
+    Wrap the response in a stream decompressing its content on the fly.
+
+    The content is decoded according to the ``Content-Encoding`` header. Additionally, gzip compressed files
+    (like ``appcast.xml.gz``) are detected by their content and decompressed as well.
+
+    :param handler: urllib response or file-like object.
+    :return: file-like object with decompressed data
+    :raise ValueError: if the content encoding is not supported
+    """
+    headers = getattr(handler, 'headers', None)
+    encoding = headers.get('Content-Encoding', '').strip().lower() if headers is not None else ''
+    if encoding in ('', 'identity'):
+        decompressor = None
+    else:
+        try:
+            decompressor = DECOMPRESSORS[encoding]()
+        except KeyError:
+            raise ValueError("Unsupported content encoding '{}'".format(encoding))
+    stream = io.BufferedReader(_DecompressingReader(handler, decompressor))
+    if stream.peek(2)[:2] == _GZIP_MAGIC:
+        stream = io.BufferedReader(_DecompressingReader(stream, DECOMPRESSORS['gzip']()))
+    return stream
@@ -0,0 +1,141 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import bz2
+
+BSDIFF_MAGIC = b'BSDIFF40'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class _LimitedReader(object):
+    """
+    Reader of a part of a file.
+    """
+
+    def __init__(self, file, offset, length=None):
+        self.file = file
+        self.file.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining is None:
+            return self.file.read(size)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def _read_exact(stream, size):
+    try:
+        data = stream.read(size)
+    except (EOFError, OSError):
+        # truncated or invalid compressed block
+        raise ValueError("Corrupted patch")
+    if len(data) != size:
+        raise ValueError("Corrupted patch")
+    return data
+
+
+def _offtin(data):
+    # bsdiff stores integers as sign and magnitude
+    value = int.from_bytes(data, 'little')
+    if value & (1 << 63):
+        value = -(value & ((1 << 63) - 1))
+    return value
+
+
+def _add_bytes(a, b):
+    # bytewise addition modulo 256 of two equal-length byte strings, done on whole chunks
+    n = len(a)
+    x = int.from_bytes(a, 'little')
+    y = int.from_bytes(b, 'little')
+    low = int.from_bytes(b'\x7f' * n, 'little')
+    return (((x & low) + (y & low)) ^ ((x ^ y) & ~low & ((1 << 8 * n) - 1))).to_bytes(n, 'little')
+
+
+def _bspatch(old, patch, chunk_size):
+    header = _read_exact(patch, 32)
+    ctrl_length = _offtin(header[8:16])
+    diff_length = _offtin(header[16:24])
+    new_size = _offtin(header[24:32])
+    if ctrl_length < 0 or diff_length < 0 or new_size < 0:
+        raise ValueError("Corrupted patch")
+    old.seek(0, 2)
+    old_size = old.tell()
+    with open(patch.name, 'rb') as ctrl_file, open(patch.name, 'rb') as diff_file, \
+            open(patch.name, 'rb') as extra_file:
+        ctrl = bz2.BZ2File(_LimitedReader(ctrl_file, 32, ctrl_length))
+        diff = bz2.BZ2File(_LimitedReader(diff_file, 32 + ctrl_length, diff_length))
+        extra = bz2.BZ2File(_LimitedReader(extra_file, 32 + ctrl_length + diff_length))
+        new_pos = old_pos = 0
+        while new_pos < new_size:
+            control = _read_exact(ctrl, 24)
+            add, copy, seek = _offtin(control[:8]), _offtin(control[8:16]), _offtin(control[16:])
+            if add < 0 or copy < 0 or new_pos + add + copy > new_size:
+                raise ValueError("Corrupted patch")
+            new_pos += add + copy
+            while add:
+                size = min(add, chunk_size)
+                data = _read_exact(diff, size)
+                # parts of the diff outside of the old file are added to zeros
+                start, end = max(old_pos, 0), min(old_pos + size, old_size)
+                if start < end:
+                    old.seek(start)
+                    source = b'\0' * (start - old_pos) + old.read(end - start) + b'\0' * (old_pos + size - end)
+                    data = _add_bytes(data, source)
+                yield data
+                old_pos += size
+                add -= size
+            while copy:
+                size = min(copy, chunk_size)
+                yield _read_exact(extra, size)
+                copy -= size
+            old_pos += seek
+
+
+def _zstd_patch(old, patch, chunk_size):
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd patches require 'zstandard' module")
+    dictionary = zstandard.ZstdCompressionDict(old.read(), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary, max_window_size=2**31)
+    with decompressor.stream_reader(patch) as reader:
+        for data in iter(lambda: reader.read(chunk_size), b''):
+            yield data
+
+
+def apply_patch(old, patch, output, verifier=None, chunk_size=1048576):
+    """
+    Apply binary patch to the old file, writing the result in chunks.
+
+    Supported formats are bsdiff (``BSDIFF40``) and zstd frames made with the old file as a raw dictionary
+    (``zstd --patch-from``). The latter requires the `zstandard` module and reads the whole old file to memory.
+
+    :param old: Name of the old file.
+    :param patch: Name of the patch file.
+    :param output: Name of the output file.
+    :param verifier: :class:`~pysparkle.backend.verify.Verifier` of the output file. It is fed with the output
+                     data while it is written and verified at the end.
+    :param chunk_size: Size of the processed chunks.
+    :raise ValueError: if the patch format is not supported or the patch is corrupted
+    """
+    with open(old, 'rb') as old_file, open(patch, 'rb') as patch_file, open(output, 'wb') as output_file:
+        magic = patch_file.read(8)
+        patch_file.seek(0)
+        if magic == BSDIFF_MAGIC:
+            chunks = _bspatch(old_file, patch_file, chunk_size)
+        elif magic[:4] == ZSTD_MAGIC:
+            chunks = _zstd_patch(old_file, patch_file, chunk_size)
+        else:
+            raise ValueError("Unsupported patch format")
+        size = 0
+        for data in chunks:
+            output_file.write(data)
+            if verifier is not None:
+                verifier.update(data)
+            size += len(data)
+    if verifier is not None:
+        verifier.verify(size)
@@ -0,0 +1,92 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+
+class _Record(object):
+    """
+    Compact record with read access compatible with dict.
+
+    Only the fields that have been set are present, so ``'url' in record``, ``record.get('url')``,
+    ``record['url']``, ``record.keys()``, and ``**record`` behave like for a dict with the same items.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def keys(self):
+        return [name for name in self._fields if hasattr(self, name)]
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        try:
+            setattr(self, name, value)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return hasattr(self, name)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.items() == other.items()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(*kv) for kv in self.items()))
+
+
+class Enclosure(_Record):
+    """
+    Downloadable file of the update.
+
+    Fields: 'url', 'ver' (machine version), 'version' (displayed version), 'signature' (DSA), 'ed_signature',
+    'digest', 'length', 'install' (installer command), 'os' (``sparkle:os`` of the enclosure),
+    'delta_from' (version the delta enclosure applies to), and 'mirrors' (tuple of all URLs of the file,
+    starting with 'url').
+    """
+
+    __slots__ = ('url', 'ver', 'version', 'signature', 'ed_signature', 'digest', 'length', 'install', 'os',
+                 'delta_from', 'mirrors')
+    _fields = __slots__
+
+
+class AppcastItem(Enclosure):
+    """
+    Parsed appcast item. The fields of its chosen enclosure are stored in the item itself.
+
+    Additional fields: 'title', 'channel', 'notes', 'notes_link', 'link', 'key' (version key), 'rank'
+    (platform rank of the enclosure), 'delta' (:class:`Enclosure` with the delta update), 'pub_date'
+    (publication timestamp), and 'rollout_interval' (phased rollout interval in seconds).
+    """
+
+    __slots__ = ('title', 'channel', 'notes', 'notes_link', 'link', 'key', 'rank', 'delta', 'pub_date',
+                 'rollout_interval')
+    _fields = Enclosure._fields + __slots__
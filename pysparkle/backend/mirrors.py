@@ -0,0 +1,179 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import time
+import socket
+import threading
+from queue import Queue, Empty
+from urllib.request import Request
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit
+
+
+def mirror_key(url):
+    """
+    Get the key of the mirror serving the URL, under which its statistics are stored.
+
+    :param url: URL of a file on the mirror.
+    :return: scheme and host of the URL
+    """
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc.lower())
+
+
+class MirrorSelector(object):
+    """
+    Opener of URLs available from several mirrors.
+
+    Mirrors are tried in the order of their past performance. If the best mirror does not respond within
+    the hedge delay, or it fails, a request to the next one is started, while the previous requests still
+    run. The first successful response is used and the other ones are closed. Response time and failures
+    of each mirror are stored in the config under 'mirror_stats', so subsequent runs start with the fastest
+    working mirror. The statistics are kept per scheme and host (see :func:`mirror_key`), so they apply to
+    all the files on the mirror, e.g. installers of the next releases.
+
+    The hedge delay can be set with 'mirror_hedge_delay' in the config. By default it is twice the average
+    response time of the best mirror, or 0.5 seconds if it is not known yet.
+
+    :param session: :class:`~pysparkle.backend.session.Session` used for requests.
+    :param pysparkle: PySparkle object.
+    :param lock: Lock guarding changes of the config, shared with the other writers. If None, a private
+                 lock is used.
+    """
+
+    #: Weight of the latest response time in its moving average
+    SMOOTHING = 0.3
+
+    #: HTTP status codes, which are valid responses and not failures of the mirror
+    VALID_ERRORS = (304, 416)
+
+    def __init__(self, session, pysparkle, lock=None):
+        self.session = session
+        self.pysparkle = pysparkle
+        self._lock = lock if lock is not None else threading.Lock()
+
+    def order(self, urls):
+        """
+        Sort mirrors from the best one. Mirrors that failed recently go last and the ones without statistics
+        keep their original order after the mirrors known to be fast.
+
+        :param urls: Sequence of mirror URLs.
+        :return: list of URLs
+        """
+        stats = self.pysparkle.config.get('mirror_stats', {})
+        timeout = self.pysparkle.timeout or 60
+
+        def score(url):
+            stat = stats.get(mirror_key(url), {})
+            return stat.get('failures', 0), stat.get('latency', timeout)
+
+        return sorted(urls, key=score)
+
+    def open(self, urls, headers=None, method=None):
+        """
+        Open the URL from the fastest responding mirror.
+
+        :param urls: Sequence of mirror URLs.
+        :param headers: Dict of request headers.
+        :param method: HTTP request method (GET by default).
+        :return: tuple of the URL of the selected mirror and the response
+        :raise HTTPError: if the response status is 304 or 416, which are valid responses, or all mirrors failed
+        :raise URLError: if all mirrors failed
+        """
+        if len(urls) == 1:
+            return urls[0], self.session.open(Request(urls[0], headers=headers or {}, method=method),
+                                              timeout=self.pysparkle.timeout)
+
+        urls = self.order(urls)
+        results = Queue()
+        delay = self.pysparkle.config.get('mirror_hedge_delay')
+        if delay is None:
+            latency = self.pysparkle.config.get('mirror_stats', {}).get(mirror_key(urls[0]), {}).get('latency')
+            delay = 2. * latency if latency is not None else 0.5
+
+        def attempt(url):
+            start = time.time()
+            try:
+                handler = self.session.open(Request(url, headers=headers or {}, method=method),
+                                            timeout=self.pysparkle.timeout)
+            except HTTPError as err:
+                if err.code in self.VALID_ERRORS:
+                    results.put((url, err, None, time.time() - start))
+                else:
+                    err.close()
+                    results.put((url, None, err, None))
+            except (URLError, socket.timeout, OSError) as err:
+                results.put((url, None, err, None))
+            else:
+                results.put((url, handler, None, time.time() - start))
+
+        started = finished = 0
+        winner = error = None
+        stats = {}
+        while finished < len(urls):
+            # a new request is started at the beginning, when the previous one failed, or it is too slow
+            if started < len(urls):
+                thread = threading.Thread(target=attempt, args=(urls[started],))
+                thread.daemon = True
+                thread.start()
+                started += 1
+            try:
+                url, handler, err, latency = results.get(timeout=delay if started < len(urls) else None)
+            except Empty:
+                continue
+            finished += 1
+            stats[url] = latency
+            if err is None:
+                winner = url, handler
+                break
+            error = err
+
+        if winner is not None and finished < started:
+            # close late responses in the background
+            thread = threading.Thread(target=self._collect, args=(results, started - finished))
+            thread.daemon = True
+            thread.start()
+        self._update_stats(stats)
+
+        if winner is None:
+            raise error
+        if isinstance(winner[1], HTTPError):
+            raise winner[1]
+        return winner
+
+    def _collect(self, results, count):
+        stats = {}
+        for _ in range(count):
+            url, handler, err, latency = results.get()
+            if handler is not None:
+                handler.close()
+            stats[url] = latency
+        self._update_stats(stats)
+
+    def _update_stats(self, results):
+        """
+        Update mirror statistics.
+
+        :param results: Dict of response times of the mirror URLs; None means a failure.
+        """
+        config = self.pysparkle.config
+        with self._lock:
+            # entries stored under other keys, e.g. full URLs, are dropped
+            stats = dict((key, stat) for key, stat in config.get('mirror_stats', {}).items()
+                         if key == mirror_key(key))
+            for url, latency in results.items():
+                key = mirror_key(url)
+                stat = dict(stats.get(key, {}))
+                if latency is None:
+                    stat['failures'] = stat.get('failures', 0) + 1
+                else:
+                    stat['failures'] = 0
+                    previous = stat.get('latency')
+                    stat['latency'] = latency if previous is None else \
+                        (1. - self.SMOOTHING) * previous + self.SMOOTHING * latency
+                stats[key] = stat
+            config['mirror_stats'] = stats
+            try:
+                config.sync()
+            except AttributeError:
+                pass
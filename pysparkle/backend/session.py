@@ -0,0 +1,198 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import threading
+import http.client as http_client
+from urllib.request import HTTPHandler, HTTPSHandler, build_opener
+from urllib.error import URLError
+
+
+class ConnectionPool(object):
+    """
+    Pool of idle HTTP connections, kept alive for reuse.
+
+    :param max_idle: Maximum number of idle connections kept for a single host.
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get an idle connection.
+
+        :param key: Connection key (connection class and host).
+        :return: connection or None if there is no idle connection for the key
+        """
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+
+    def put(self, key, connection):
+        """
+        Return a connection to the pool.
+
+        :param key: Connection key (connection class and host).
+        :param connection: Connection to return.
+        """
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class _PooledResponse(http_client.HTTPResponse):
+    """
+    HTTP response returning its connection to the pool once it is read or closed.
+    """
+
+    _release = None
+
+    def _close_conn(self):
+        http_client.HTTPResponse._close_conn(self)
+        self._return(True)
+
+    def close(self):
+        if self.fp is not None:
+            # the connection can only be reused if the whole body has been read
+            self._return(self.length == 0)
+        http_client.HTTPResponse.close(self)
+
+    def _return(self, reuse):
+        release, self._release = self._release, None
+        if release is not None:
+            release(reuse and not self.will_close)
+
+
+class _KeepAliveMixin(object):
+
+    def __init__(self, pool, *args, **kwargs):
+        super(_KeepAliveMixin, self).__init__(*args, **kwargs)
+        self._pool = pool
+
+    def _release(self, key, connection, reuse):
+        if not reuse:
+            connection.close()
+        self._pool.put(key, connection)
+
+    def do_open_pooled(self, http_class, req, **http_conn_args):
+        if req._tunnel_host:
+            # connections tunnelled through a proxy are not pooled
+            return self.do_open(http_class, req, **http_conn_args)
+        host = req.host
+        if not host:
+            raise URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        key = http_class, host
+        idempotent = req.get_method() in ('GET', 'HEAD') and req.data is None
+        while True:
+            connection = self._pool.get(key)
+            if connection is None:
+                connection = http_class(host, timeout=req.timeout, **http_conn_args)
+                connection.response_class = _PooledResponse
+                connection.set_debuglevel(self._debuglevel)
+            reused = connection.sock is not None
+            connection.timeout = req.timeout
+            if reused:
+                connection.sock.settimeout(req.timeout)
+            try:
+                try:
+                    connection.request(req.get_method(), req.selector, req.data, headers,
+                                       encode_chunked=req.has_header('Transfer-encoding'))
+                    response = connection.getresponse()
+                except (ConnectionError, http_client.BadStatusLine):
+                    # server may have closed the idle connection, so retry with a new one
+                    if reused and idempotent:
+                        connection.close()
+                        self._pool.put(key, connection)
+                        continue
+                    raise
+            except OSError as err:
+                connection.close()
+                raise URLError(err)
+            except:
+                connection.close()
+                raise
+            break
+
+        response._release = lambda reuse: self._release(key, connection, reuse)
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, HTTPHandler):
+    """
+    HTTP handler keeping connections alive in the given pool.
+
+    :param pool: :class:`ConnectionPool` object.
+    """
+
+    def http_open(self, req):
+        return self.do_open_pooled(http_client.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, HTTPSHandler):
+    """
+    HTTPS handler keeping connections alive in the given pool.
+
+    :param pool: :class:`ConnectionPool` object.
+    """
+
+    def https_open(self, req):
+        return self.do_open_pooled(http_client.HTTPSConnection, req, context=self._context)
+
+
+class Session(object):
+    """
+    HTTP session used for all PySparkle requests. Connections are kept alive and reused for subsequent
+    requests to the same host, so the appcast, release notes and the installer downloaded from one server
+    need only one TCP and TLS handshake.
+
+    The session has its own opener, so handlers and headers given here are used only for its requests.
+
+    :param handlers: Additional urllib handlers for the session opener.
+    :param headers: Dict of headers added to every request.
+    """
+
+    def __init__(self, *handlers, headers=None):
+        self.pool = ConnectionPool()
+        self.opener = build_opener(KeepAliveHTTPHandler(self.pool), KeepAliveHTTPSHandler(self.pool), *handlers)
+        if headers:
+            self.opener.addheaders = [(k, v) for k, v in self.opener.addheaders if k.lower() not in
+                                      set(h.lower() for h in headers)] + list(headers.items())
+
+    def open(self, url, timeout=None):
+        """
+        Open the URL.
+
+        :param url: URL string or urllib Request object.
+        :param timeout: Connection timeout.
+        :return: response object
+        """
+        return self.opener.open(url, timeout=timeout)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        self.pool.close()
@@ -0,0 +1,179 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import base64
+import hashlib
+
+from . import VerificationError
+
+
+# Ed25519 (RFC 8032) signature verification. The implementation is used instead of any external library,
+# as the signed message is hashed incrementally while it is being downloaded.
+
+_P = 2**255 - 19
+_L = 2**252 + 27742317777372353535851937790883648493
+_D = -121665 * pow(121666, _P - 2, _P) % _P
+_SQRT_M1 = pow(2, (_P - 1) // 4, _P)
+
+
+def _recover_x(y, sign):
+    if y >= _P:
+        return None
+    x2 = (y * y - 1) * pow(_D * y * y + 1, _P - 2, _P)
+    if x2 == 0:
+        return None if sign else 0
+    x = pow(x2, (_P + 3) // 8, _P)
+    if (x * x - x2) % _P != 0:
+        x = x * _SQRT_M1 % _P
+    if (x * x - x2) % _P != 0:
+        return None
+    if (x & 1) != sign:
+        x = _P - x
+    return x
+
+
+def _point_add(p, q):
+    # points are in extended homogeneous coordinates (X, Y, Z, T)
+    a = (p[1] - p[0]) * (q[1] - q[0]) % _P
+    b = (p[1] + p[0]) * (q[1] + q[0]) % _P
+    c = 2 * p[3] * q[3] * _D % _P
+    d = 2 * p[2] * q[2] % _P
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return e * f, g * h, f * g, e * h
+
+
+def _point_mul(s, p):
+    q = (0, 1, 1, 0)
+    while s > 0:
+        if s & 1:
+            q = _point_add(q, p)
+        p = _point_add(p, p)
+        s >>= 1
+    return q
+
+
+def _point_equal(p, q):
+    return (p[0] * q[2] - q[0] * p[2]) % _P == 0 and (p[1] * q[2] - q[1] * p[2]) % _P == 0
+
+
+def _point_decompress(data):
+    if len(data) != 32:
+        return None
+    y = int.from_bytes(data, 'little')
+    sign = y >> 255
+    y &= (1 << 255) - 1
+    x = _recover_x(y, sign)
+    if x is None:
+        return None
+    return x, y, 1, x * y % _P
+
+
+_G_Y = 4 * pow(5, _P - 2, _P) % _P
+_G_X = _recover_x(_G_Y, 0)
+_G = _G_X, _G_Y, 1, _G_X * _G_Y % _P
+
+
+class Verifier(object):
+    """
+    Verifier of downloaded update files. Data is fed to it with :meth:`update` while it is being downloaded,
+    so the file does not need to be read again for verification.
+
+    The following checks are done, depending on the item attributes and the config:
+
+    * file size is compared with the enclosure ``length``, if it is given;
+    * file digest is compared with the enclosure ``sparkle:digest`` attribute, which should have the form
+      ``algorithm:hexdigest``, e.g. ``sha256:9f86d08...``, where the algorithm is any supported by hashlib;
+    * if ``ed_public_key`` (base64 encoded Ed25519 public key, the same as Sparkle SUPublicEDKey) is set in the
+      config, the enclosure must have a valid ``sparkle:edSignature``;
+    * if ``dsa_public_key`` (PEM encoded DSA public key) is set in the config, the enclosure must have a valid
+      ``sparkle:dsaSignature``. This requires the `cryptography` module.
+
+    :param item: Update item.
+    :param config: PySparkle config.
+    """
+
+    def __init__(self, item, config):
+        self.url = item['url']
+        self.length = int(item.get('length') or 0)
+        self.hashes = []
+
+        self.digest = item.get('digest')
+        if self.digest:
+            algorithm, _, self.digest = self.digest.partition(':')
+            try:
+                self.digest_hash = hashlib.new(algorithm.strip().lower())
+            except ValueError:
+                raise VerificationError(self.url, "Unsupported digest algorithm '{}'".format(algorithm))
+            self.digest = self.digest.strip().lower()
+            self.hashes.append(self.digest_hash)
+
+        self.ed_key = config.get('ed_public_key')
+        if self.ed_key:
+            self.ed_key = base64.b64decode(self.ed_key)
+            if not item.get('ed_signature'):
+                raise VerificationError(self.url, "Missing EdDSA signature")
+            self.ed_signature = base64.b64decode(item['ed_signature'])
+            self.ed_hash = hashlib.sha512(self.ed_signature[:32] + self.ed_key)
+            self.hashes.append(self.ed_hash)
+
+        self.dsa_key = config.get('dsa_public_key')
+        if self.dsa_key:
+            if not item.get('signature'):
+                raise VerificationError(self.url, "Missing DSA signature")
+            self.dsa_signature = base64.b64decode(item['signature'])
+            self.dsa_hash = hashlib.sha1()
+            self.hashes.append(self.dsa_hash)
+
+    def update(self, data):
+        """
+        Feed downloaded data.
+
+        :param data: Next chunk of the downloaded file.
+        """
+        for hash in self.hashes:
+            hash.update(data)
+
+    def verify(self, size):
+        """
+        Verify the downloaded file.
+
+        :param size: Total size of the downloaded file.
+        :raise VerificationError: if any of the checks fails
+        """
+        if self.length and size != self.length:
+            raise VerificationError(self.url, "File size {} does not match expected {}".format(size, self.length))
+        if self.digest and self.digest_hash.hexdigest() != self.digest:
+            raise VerificationError(self.url, "File digest does not match")
+        if self.ed_key and not self._verify_ed25519():
+            raise VerificationError(self.url, "Invalid EdDSA signature")
+        if self.dsa_key:
+            self._verify_dsa()
+
+    def _verify_ed25519(self):
+        if len(self.ed_key) != 32 or len(self.ed_signature) != 64:
+            return False
+        a = _point_decompress(self.ed_key)
+        r = _point_decompress(self.ed_signature[:32])
+        if a is None or r is None:
+            return False
+        s = int.from_bytes(self.ed_signature[32:], 'little')
+        if s >= _L:
+            return False
+        h = int.from_bytes(self.ed_hash.digest(), 'little') % _L
+        return _point_equal(_point_mul(s, _G), _point_add(r, _point_mul(h, a)))
+
+    def _verify_dsa(self):
+        # Sparkle DSA signature is made for SHA-1 digest of the file
+        try:
+            from cryptography.exceptions import InvalidSignature
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.serialization import load_pem_public_key
+        except ImportError:
+            raise VerificationError(self.url, "DSA signature verification requires 'cryptography' module")
+        key = self.dsa_key
+        if not isinstance(key, bytes):
+            key = key.encode('ascii')
+        try:
+            load_pem_public_key(key).verify(self.dsa_signature, self.dsa_hash.digest(), hashes.SHA1())
+        except (InvalidSignature, ValueError):
+            raise VerificationError(self.url, "Invalid DSA signature")
@@ -1029,6 +1029,8 @@ class LinuxDistribution(object):
 
     @cached_property
     def _uname_info(self):
+        if not self.include_uname:
+            return {}
         with open(os.devnull, 'w') as devnull:
             try:
                 cmd = ('uname', '-rs')
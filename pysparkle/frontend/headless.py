@@ -0,0 +1,119 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+"""
+Frontend for unattended updates. It does not import any GUI toolkit: messages are logged with the
+``pysparkle`` logger and questions are answered according to the policy set in the PySparkle config:
+
+* 'automatic_check_policy': answer to the question about automatic checks (True by default);
+* 'auto_accept': which updates are downloaded and installed without asking: 'none' (default; updates are
+  only logged), 'patch' (only if the major and minor version numbers do not change), 'minor' (only if the
+  major version number does not change), or 'all'. The application version is compared with ``sparkle:version``
+  of the update. Updates without an installer command are never accepted.
+
+Each log record has a ``pysparkle_event`` attribute with a dict describing the event, which can be used
+by structured (e.g. JSON) log handlers.
+"""
+
+import re
+import time
+import logging
+
+logger = logging.getLogger('pysparkle')
+
+ACCEPT_POLICIES = ('none', 'patch', 'minor', 'all')
+
+
+def _log(level, event, msg, *args, **data):
+    data['event'] = event
+    logger.log(level, msg, *args, extra={'pysparkle_event': data})
+
+
+def _numbers(version, count):
+    numbers = [int(n) for n in re.findall(r'\d+', version)[:count]]
+    return numbers + [0] * (count - len(numbers))
+
+
+def accepts(policy, current, new):
+    """
+    Check if the update is accepted by the policy.
+
+    :param policy: One of :data:`ACCEPT_POLICIES`.
+    :param current: Current version string.
+    :param new: New machine version string (``sparkle:version``).
+    :return: True if the update should be installed
+    """
+    if policy not in ACCEPT_POLICIES:
+        raise ValueError("Unknown update policy '{}'".format(policy))
+    if policy == 'all':
+        return True
+    if policy == 'none':
+        return False
+    count = 2 if policy == 'patch' else 1
+    return _numbers(current, count) == _numbers(new, count)
+
+
+def ask_for_autocheck(pysparkle):
+    answer = bool(pysparkle.config.get('automatic_check_policy', True))
+    _log(logging.INFO, 'autocheck', "Automatic update checks for %s %s", pysparkle.appname,
+         "enabled" if answer else "disabled", enabled=answer)
+    return answer
+
+
+def update_error(msg=None):
+    _log(logging.ERROR, 'error', "Update error: %s", msg, message=str(msg) if msg is not None else None)
+
+
+def no_info(pysparkle):
+    _log(logging.WARNING, 'no_info', "There is no update information for %s", pysparkle.appname)
+
+
+def no_update(pysparkle):
+    _log(logging.INFO, 'no_update', "%s %s is currently the newest version available",
+         pysparkle.appname, pysparkle.appver, version=pysparkle.appver)
+
+
+def update_available(pysparkle, maxitem, items):
+    policy = pysparkle.config.get('auto_accept', 'none')
+    accept = accepts(policy, pysparkle.appver, maxitem['ver'])
+    if accept and pysparkle._install_command(maxitem) is None:
+        _log(logging.WARNING, 'no_installer', "%s %s has no installer command and cannot be installed unattended",
+             pysparkle.appname, maxitem['version'], version=maxitem['version'])
+        accept = False
+    _log(logging.INFO, 'update_available', "%s %s is available (current version %s)%s",
+         pysparkle.appname, maxitem['version'], pysparkle.appver, "; installing" if accept else "",
+         version=maxitem['version'], current=pysparkle.appver, url=maxitem['url'], accepted=accept)
+    if accept:
+        return True
+
+
+class _DownloadProgress(object):
+    """
+    Download progress logged every 10% or every 10 seconds.
+    """
+
+    def __init__(self, pysparkle, item):
+        self.name = '{} {}'.format(pysparkle.appname, item['version'])
+        self.url = item['url']
+        self.step = 10
+        self.interval = 10.
+        self.last_percent = None
+        self.last_time = time.time()
+        _log(logging.INFO, 'download_start', "Downloading %s", self.name, url=self.url)
+
+    def update(self, received, total):
+        now = time.time()
+        percent = 100 * received // total if total else None
+        if percent is not None and (self.last_percent is None or percent >= self.last_percent + self.step) or \
+                now - self.last_time >= self.interval:
+            self.last_percent = percent
+            self.last_time = now
+            _log(logging.INFO, 'download_progress', "Downloading %s: %s of %s bytes", self.name, received,
+                 total if total is not None else "unknown", url=self.url, received=received, total=total)
+        return True
+
+    def close(self):
+        _log(logging.INFO, 'download_end', "Download of %s ended", self.name, url=self.url)
+
+
+def download_progress(pysparkle, item):
+    return _DownloadProgress(pysparkle, item)
@@ -3,22 +3,28 @@
 
 import sys
 if 'PySide6' in sys.modules:
-    from PySide6.QtWidgets import QMessageBox, QLabel, QTextEdit
+    from PySide6.QtCore import QObject, Signal
+    from PySide6.QtWidgets import QMessageBox, QLabel, QTextEdit, QProgressDialog
     _exec_attr = 'exec'
 elif 'PyQt6' in sys.modules:
-    from PyQt6.QtWidgets import QMessageBox, QLabel, QTextEdit
+    from PyQt6.QtCore import QObject, pyqtSignal as Signal
+    from PyQt6.QtWidgets import QMessageBox, QLabel, QTextEdit, QProgressDialog
     _exec_attr = 'exec'
 elif 'PySide2' in sys.modules:
-    from PySide2.QtWidgets import QMessageBox, QLabel, QTextEdit
+    from PySide2.QtCore import QObject, Signal
+    from PySide2.QtWidgets import QMessageBox, QLabel, QTextEdit, QProgressDialog
     _exec_attr = 'exec_'
 elif 'PyQt5' in sys.modules:
-    from PyQt5.QtWidgets import QMessageBox, QLabel, QTextEdit
+    from PyQt5.QtCore import QObject, pyqtSignal as Signal
+    from PyQt5.QtWidgets import QMessageBox, QLabel, QTextEdit, QProgressDialog
     _exec_attr = 'exec_'
 else:
     if 'PySide' in sys.modules:
-        from PySide.QtGui import QMessageBox, QLabel, QTextEdit
+        from PySide.QtCore import QObject, Signal
+        from PySide.QtGui import QMessageBox, QLabel, QTextEdit, QProgressDialog
     elif 'PyQt4' in sys.modules:
-        from PyQt4.QtGui import QMessageBox, QLabel, QTextEdit
+        from PyQt4.QtCore import QObject, pyqtSignal as Signal
+        from PyQt4.QtGui import QMessageBox, QLabel, QTextEdit, QProgressDialog
     else:
         raise ImportError("cannot determine Qt bindings: import desired Qt module first")
     _exec_attr = 'exec_'
@@ -30,6 +36,28 @@ else:
     QMessageBox.StandardButton.No = QMessageBox.No
 
 
+class _Invoker(QObject):
+    """
+    Helper object living in the main thread. Functions emitted with its signal from any other thread are
+    called in the main thread, once its event loop is running.
+    """
+    invoke = Signal(object)
+
+    def __init__(self):
+        super(_Invoker, self).__init__()
+        self.invoke.connect(self._call)
+
+    def _call(self, func):
+        func()
+
+
+_invoker = _Invoker()
+
+
+def call_in_main_thread(func, *args):
+    _invoker.invoke.emit(lambda: func(*args))
+
+
 def ask_for_autocheck(pysparkle):
     dialog = QMessageBox()
     dialog.setIcon(QMessageBox.Icon.Question)
@@ -97,3 +125,28 @@ def update_available(pysparkle, maxitem, items):
     result = dialog.clickedButton()
     if result in (get_button, skip_button):
         return result == get_button
+
+
+class _DownloadProgress(object):
+
+    def __init__(self, pysparkle, item):
+        self.dialog = QProgressDialog()
+        self.dialog.setWindowTitle(self.dialog.tr("Downloading update"))
+        self.dialog.setLabelText(self.dialog.tr("Downloading {} {}...").format(pysparkle.appname, item['version']))
+        self.dialog.setModal(True)
+        self.dialog.setMinimumDuration(0)
+        self.dialog.setRange(0, 0)
+
+    def update(self, received, total):
+        # values are in KiB, so they fit in int for large files
+        if total is not None and self.dialog.maximum() != total // 1024:
+            self.dialog.setRange(0, total // 1024)
+        self.dialog.setValue(received // 1024)
+        return not self.dialog.wasCanceled()
+
+    def close(self):
+        self.dialog.close()
+
+
+def download_progress(pysparkle, item):
+    return _DownloadProgress(pysparkle, item)
@@ -0,0 +1,134 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import time
+import random
+import threading
+
+
+class Scheduler(object):
+    """
+    Scheduler of periodic update checks.
+
+    It is configured with the following PySparkle config keys:
+
+    * 'check_interval': interval between the checks in seconds; if not set, no periodic checks are done;
+    * 'check_jitter': maximum random delay added to each check as a fraction of the delay (0.1 by default),
+      so the clients started at the same time do not check simultaneously;
+    * 'check_retry': delay in seconds before the first retry after a failed check (60 by default).
+      Each subsequent retry delay is doubled up to the check interval. If the server sends ``Retry-After``
+      header, its value is used instead;
+    * 'check_startup_jitter': maximum random delay in seconds of the due check at startup, if it is done
+      in background (by default 'check_jitter' times the interval, or :attr:`STARTUP_JITTER` if no interval
+      is set), so the clients restarted at the same time do not check simultaneously.
+
+    Time of the last successful check is stored in the config as 'last_check_time'. Checks are scheduled only
+    after :meth:`start` has been called and while 'automatic_check' is enabled in the config.
+
+    :param pysparkle: PySparkle object.
+    """
+
+    #: Default maximum delay in seconds of the startup check without the check interval
+    STARTUP_JITTER = 60
+
+    def __init__(self, pysparkle):
+        self.pysparkle = pysparkle
+        config = pysparkle.config
+        self.interval = config.get('check_interval')
+        self.jitter = config.get('check_jitter', 0.1)
+        self.retry = config.get('check_retry', 60)
+        self.startup_jitter = config.get('check_startup_jitter')
+        if self.startup_jitter is None:
+            self.startup_jitter = self.jitter * self.interval if self.interval is not None else self.STARTUP_JITTER
+        self.failures = 0
+        self.started = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def due(self):
+        """
+        Check if the update check is due.
+
+        :return: True if periodic checks are disabled or the last check was at least the interval ago
+        """
+        last = self.pysparkle.config.get('last_check_time')
+        if self.interval is None or last is None:
+            return True
+        return not 0 <= time.time() - last < self.interval
+
+    def start(self):
+        """
+        Start periodic checks and schedule the next check the interval after the last one. If the check is
+        already due, nothing is scheduled: the caller should check for updates now and the next check is
+        scheduled after it.
+        """
+        self.started = True
+        if self.interval is not None and not self.due():
+            last = self.pysparkle.config.get('last_check_time')
+            self._schedule(max(0, last + self.interval - time.time()))
+
+    def start_due(self):
+        """
+        Schedule the due check after a random delay of up to 'check_startup_jitter' seconds.
+        The check is done in background.
+        """
+        self.started = True
+        self._schedule(0, self.startup_jitter)
+
+    def stop(self):
+        """
+        Stop periodic checks and cancel the scheduled one.
+        """
+        self.started = False
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def checked(self, err):
+        """
+        Schedule the next check after an update check.
+
+        :param err: Exception raised while retrieving the update information or None on success.
+        """
+        if err is not None:
+            self.failures += 1
+            if not self._enabled():
+                return
+            delay = getattr(err, 'retry_after', None)
+            if delay is None:
+                delay = min(self.retry * 2 ** (self.failures - 1), self.interval)
+        else:
+            self.failures = 0
+            config = self.pysparkle.config
+            config['last_check_time'] = time.time()
+            try:
+                config.sync()
+            except AttributeError:
+                pass
+            if not self._enabled():
+                return
+            delay = self.interval
+        self._schedule(delay)
+
+    def _enabled(self):
+        return self.started and self.interval is not None and self.pysparkle.config.get('automatic_check')
+
+    def _schedule(self, delay, spread=None):
+        """
+        Schedule the check after the delay increased by a random time of up to `spread` seconds
+        (by default the delay times the jitter).
+        """
+        if spread is None:
+            spread = delay * self.jitter
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay + random.uniform(0., spread), self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        self.pysparkle.check_update(verbose=False, background=True)
@@ -0,0 +1,72 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import re
+
+try:
+    from packaging.version import Version, InvalidVersion
+except ImportError:
+    Version = None
+
+_COMPONENTS = re.compile(r'(\d+)|([^\W\d_]+)|([\W_]+)', re.UNICODE)
+
+# Ranks of version components. Numbers are newer than separators, which are newer than the end of version,
+# which in turn is newer than strings. So 1.0.1 > 1.0 > 1.0b1.
+_STRING, _END, _SEPARATOR, _NUMBER = range(4)
+
+
+def _sparkle_key(version):
+    parts = []
+    for number, string, _ in _COMPONENTS.findall(version):
+        if number:
+            parts.append((_NUMBER, int(number)))
+        elif string:
+            # separator before a string is irrelevant, i.e. 1.0-beta is the same as 1.0beta
+            if parts and parts[-1][0] == _SEPARATOR:
+                parts.pop()
+            parts.append((_STRING, string))
+        else:
+            parts.append((_SEPARATOR, ''))
+    if parts and parts[-1][0] == _SEPARATOR:
+        parts.pop()
+    parts.append((_END, ''))
+    return tuple(parts)
+
+
+def _pep440_key(version):
+    if Version is None:
+        raise ImportError("PEP 440 version scheme requires 'packaging' module")
+    try:
+        return 1, Version(version)
+    except InvalidVersion:
+        # invalid versions are older than any valid one
+        return 0, _sparkle_key(version)
+
+
+SCHEMES = {
+    'sparkle': _sparkle_key,
+    'pep440': _pep440_key,
+}
+
+
+def version_key(version, scheme='sparkle'):
+    """
+    Compute the sort key of a version string.
+
+    With 'sparkle' scheme the version is compared like in Sparkle: it is split into numbers, strings and
+    separators, which are compared piecewise. Numbers are compared numerically, so 1.10 is newer than 1.9,
+    and a string after the common part denotes a pre-release, so 1.0 is newer than 1.0b1.
+
+    With 'pep440' scheme the version is parsed according to PEP 440 using the `packaging` module.
+    Versions that are not PEP 440 compliant are considered older than any compliant one.
+
+    Keys of the same scheme can be compared with each other.
+
+    :param version: Version string.
+    :param scheme: Version scheme name: 'sparkle' or 'pep440'.
+    :return: Hashable and comparable version key.
+    """
+    return SCHEMES[scheme](version)
+
+
+__all__ = ['version_key']
@@ -0,0 +1,106 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import os
+import bz2
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from pysparkle.backend import VerificationError
+from pysparkle.backend.delta import apply_patch
+from pysparkle.backend.verify import Verifier
+
+
+def _offout(value):
+    # bsdiff stores integers as sign and magnitude
+    return (abs(value) | (1 << 63 if value < 0 else 0)).to_bytes(8, 'little')
+
+
+def make_bsdiff(old, controls):
+    """
+    Build BSDIFF40 patch.
+
+    :param old: Old data.
+    :param controls: List of tuples of new data made by adding the diff to the old data, new data copied
+                     from the extra block, and the seek in the old data.
+    :return: tuple of the patch and the new data
+    """
+    ctrl, diff, extra, new = [], [], [], []
+    pos = 0
+    for added, copied, seek in controls:
+        source = old[pos:pos + len(added)].ljust(len(added), b'\0') if pos >= 0 else b'\0' * len(added)
+        diff.append(bytes((a - s) % 256 for a, s in zip(added, source)))
+        extra.append(copied)
+        new += [added, copied]
+        ctrl.append(_offout(len(added)) + _offout(len(copied)) + _offout(seek))
+        pos += len(added) + seek
+    ctrl, diff, extra = (bz2.compress(b''.join(block)) for block in (ctrl, diff, extra))
+    new = b''.join(new)
+    header = b'BSDIFF40' + _offout(len(ctrl)) + _offout(len(diff)) + _offout(len(new))
+    return header + ctrl + diff + extra, new
+
+
+class BsdiffTest(unittest.TestCase):
+
+    old = bytes(range(256)) * 64 + b'The quick brown fox jumps over the lazy dog'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.old_name = self.file('old', self.old)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def file(self, name, data=None):
+        name = os.path.join(self.directory, name)
+        if data is not None:
+            with open(name, 'wb') as output:
+                output.write(data)
+        return name
+
+    def patch(self, patch, chunk_size=1048576, verifier=None):
+        output = self.file('new')
+        apply_patch(self.old_name, self.file('patch', patch), output, verifier, chunk_size)
+        with open(output, 'rb') as new:
+            return new.read()
+
+    def test_apply(self):
+        added = bytes((b + 3) % 256 for b in self.old[:5000])  # wraps around modulo 256
+        patch, new = make_bsdiff(self.old, [
+            (added, b'inserted data', -1000),
+            (self.old[4000:4100], b'', 12000),
+            (b'The slow brown fox', b' walks', 100),  # reads past the end of the old file
+        ])
+        self.assertEqual(self.patch(patch), new)
+        # small chunks split the diff and extra blocks
+        self.assertEqual(self.patch(patch, chunk_size=7), new)
+
+    def test_verifier(self):
+        patch, new = make_bsdiff(self.old, [(self.old[:100], b'new', 0)])
+        item = {'url': 'http://example.com/app.bin', 'digest': 'sha256:' + hashlib.sha256(new).hexdigest()}
+        self.assertEqual(self.patch(patch, verifier=Verifier(item, {})), new)
+        item['digest'] = 'sha256:' + hashlib.sha256(self.old).hexdigest()
+        with self.assertRaises(VerificationError):
+            self.patch(patch, verifier=Verifier(item, {}))
+
+    def test_corrupted(self):
+        patch, new = make_bsdiff(self.old, [(self.old[:100], b'new', 0)])
+        # new size larger than the data in the blocks
+        header = patch[:24] + (len(new) + 10).to_bytes(8, 'little')
+        with self.assertRaises(ValueError):
+            self.patch(header + patch[32:])
+        with self.assertRaises(ValueError):
+            self.patch(patch[:40])
+        # invalid compressed data
+        with self.assertRaises(ValueError):
+            self.patch(patch[:40] + bytes(b ^ 0xff for b in patch[40:60]) + patch[60:])
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            self.patch(b'NOTAPATCH' + b'\0' * 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import base64
+import hashlib
+import unittest
+
+from pysparkle.backend import VerificationError
+from pysparkle.backend.verify import Verifier
+
+# test vectors 1, 2, and 3 from RFC 8032, section 7.1
+RFC8032 = [
+    ('d75a980182b10ab7d54bfed3c964073a0ee172f3daa62325af021a68f707511a', '',
+     'e5564300c360ac729086e2cc806e828a84877f1eb8e5d974d873e06522490155'
+     '5fb8821590a33bacc61e39701cf9b46bd25bf5f0595bbe24655141438e7a100b'),
+    ('3d4017c3e843895a92b70aa74d1b7ebc9c982ccf2ec4968cc0cd55f12af4660c', '72',
+     '92a009a9f0d4cab8720e820b5f642540a2b27b5416503f8fb3762223ebdb69da'
+     '085ac1e43e15996e458f3613d0f11d8c387b2eaeb4302aeeb00d291612bb0c00'),
+    ('fc51cd8e6218a1a38da47ed00230f0580816ed13ba3303ac5deb911548908025', 'af82',
+     '6291d657deec24024827e69c3abe01a30ce548a284743a445e3680d7db5ac3ac'
+     '18ff9b538d16f290ae67f760984dc6594a7c15e9716ed28dc027beceea1ec40a'),
+]
+
+
+def _b64(hex):
+    return base64.b64encode(bytes.fromhex(hex)).decode('ascii')
+
+
+def _verify(item, config, data, chunk_size=None):
+    verifier = Verifier(dict(item, url='http://example.com/app.bin'), config)
+    chunk_size = chunk_size or max(len(data), 1)
+    for i in range(0, len(data), chunk_size):
+        verifier.update(data[i:i + chunk_size])
+    verifier.verify(len(data))
+
+
+class Ed25519Test(unittest.TestCase):
+
+    def test_rfc8032_vectors(self):
+        for key, message, signature in RFC8032:
+            _verify({'ed_signature': _b64(signature)}, {'ed_public_key': _b64(key)}, bytes.fromhex(message))
+
+    def test_chunked_data(self):
+        key, message, signature = RFC8032[2]
+        _verify({'ed_signature': _b64(signature)}, {'ed_public_key': _b64(key)}, bytes.fromhex(message), 1)
+
+    def test_modified_data(self):
+        key, message, signature = RFC8032[1]
+        with self.assertRaises(VerificationError):
+            _verify({'ed_signature': _b64(signature)}, {'ed_public_key': _b64(key)}, b'\x73')
+
+    def test_modified_signature(self):
+        key, message, signature = RFC8032[0]
+        for i in (0, 40):
+            broken = bytearray.fromhex(signature)
+            broken[i] ^= 1
+            with self.assertRaises(VerificationError):
+                _verify({'ed_signature': base64.b64encode(bytes(broken)).decode('ascii')},
+                        {'ed_public_key': _b64(key)}, b'')
+
+    def test_wrong_key(self):
+        with self.assertRaises(VerificationError):
+            _verify({'ed_signature': _b64(RFC8032[0][2])}, {'ed_public_key': _b64(RFC8032[1][0])}, b'')
+
+    def test_missing_signature(self):
+        with self.assertRaises(VerificationError):
+            _verify({}, {'ed_public_key': _b64(RFC8032[0][0])}, b'')
+
+    def test_no_key(self):
+        # signature is not checked if there is no key in the config
+        _verify({'ed_signature': _b64(RFC8032[0][2])}, {}, b'anything')
+
+
+class DigestTest(unittest.TestCase):
+
+    data = b'PySparkle update' * 1000
+
+    def test_digest(self):
+        digest = 'sha256:' + hashlib.sha256(self.data).hexdigest()
+        _verify({'digest': digest, 'length': len(self.data)}, {}, self.data, 4096)
+        _verify({'digest': 'SHA256:' + hashlib.sha256(self.data).hexdigest().upper()}, {}, self.data)
+
+    def test_wrong_digest(self):
+        with self.assertRaises(VerificationError):
+            _verify({'digest': 'sha256:' + hashlib.sha256(b'other').hexdigest()}, {}, self.data)
+
+    def test_unsupported_algorithm(self):
+        with self.assertRaises(VerificationError):
+            _verify({'digest': 'nosuchhash:00'}, {}, self.data)
+
+    def test_length(self):
+        with self.assertRaises(VerificationError):
+            _verify({'length': len(self.data) + 1}, {}, self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# Copyright (c) 2015-2016 Maciej Dems <maciej.dems@p.lodz.pl>
+# See LICENSE file for copyright information.
+
+import unittest
+
+from pysparkle import version
+from pysparkle.version import version_key
+
+
+class SparkleVersionTest(unittest.TestCase):
+
+    def assertNewer(self, newer, older, scheme='sparkle'):
+        self.assertGreater(version_key(newer, scheme), version_key(older, scheme))
+
+    def test_numbers_are_compared_numerically(self):
+        self.assertNewer('1.10', '1.9')
+        self.assertNewer('2.0', '1.99.99')
+        self.assertNewer('1.0.10', '1.0.9')
+
+    def test_longer_version_is_newer(self):
+        self.assertNewer('1.0.1', '1.0')
+        self.assertNewer('1.0.0', '1.0')
+
+    def test_prerelease_is_older(self):
+        self.assertNewer('1.0', '1.0b1')
+        self.assertNewer('1.0b2', '1.0b1')
+        self.assertNewer('1.0b1', '1.0a5')
+        self.assertNewer('1.0.1', '1.0b1')
+
+    def test_separator_before_string_is_ignored(self):
+        self.assertEqual(version_key('1.0-beta'), version_key('1.0beta'))
+        self.assertEqual(version_key('1.0.beta'), version_key('1.0beta'))
+
+    def test_build_numbers(self):
+        self.assertNewer('1234', '1233')
+        self.assertNewer('10000', '9999')
+
+    def test_keys_are_hashable(self):
+        self.assertEqual(len({version_key('1.0'), version_key('1.0'), version_key('1.1')}), 2)
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(KeyError):
+            version_key('1.0', 'semver')
+
+
+@unittest.skipIf(version.Version is None, "requires 'packaging' module")
+class PEP440VersionTest(unittest.TestCase):
+
+    def assertNewer(self, newer, older):
+        self.assertGreater(version_key(newer, 'pep440'), version_key(older, 'pep440'))
+
+    def test_ordering(self):
+        self.assertNewer('1.10', '1.9')
+        self.assertNewer('1.0', '1.0rc1')
+        self.assertNewer('1.0rc1', '1.0b2')
+        self.assertNewer('1.0.post1', '1.0')
+        self.assertNewer('1.0', '1.0.dev1')
+
+    def test_normalization(self):
+        self.assertEqual(version_key('1.0', 'pep440'), version_key('1.0.0', 'pep440'))
+
+    def test_invalid_version_is_older(self):
+        self.assertNewer('0.1', 'nightly-20240101')
+
+
+if __name__ == '__main__':
+    unittest.main()